@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import resource
+import numpy as np
+import steam.steamapi as api
+import benchmarks.simulator as sim
+
+
+def get_peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def write_config(base_url, pool_size):
+    config = {'key': 'benchmark', 'base_url': base_url,
+              'store_url': base_url, 'pool_size': pool_size,
+              'retry': {'max_retries': 3, 'backoff_base': 0.1,
+                        'backoff_max': 2.0}}
+    config_file = os.path.join('cfg', 'conf.json')
+    os.makedirs('cfg')
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+    return config_file
+
+
+def instrument(steam_api, latencies):
+    session_get = steam_api.session.get
+
+    def timed_get(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return session_get(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start_time)
+    steam_api.session.get = timed_get
+
+
+def get_result(name, workers, elapsed, latencies, hits):
+    latencies = np.array(latencies) if latencies else np.array([0.0])
+    return {'benchmark': name, 'workers': workers,
+            'requests': len(latencies), 'hits': hits,
+            'seconds': elapsed,
+            'requests_per_sec': len(latencies) / elapsed,
+            'hits_per_sec': hits / elapsed,
+            'p50_ms': np.percentile(latencies, 50) * 1000,
+            'p99_ms': np.percentile(latencies, 99) * 1000,
+            'peak_rss_mb': get_peak_rss()}
+
+
+def bench_search(config_file, searches, workers, last_steam_id):
+    steam_api = api.SteamApi(config_file)
+    steam_api.last_steam_id = last_steam_id
+    latencies = []
+    instrument(steam_api, latencies)
+    start_time = time.perf_counter()
+    df = steam_api.user_search_loop(searches, workers)
+    elapsed = time.perf_counter() - start_time
+    hits = df['steam_id'].nunique() if not df.empty else 0
+    return get_result('user_search_loop', workers, elapsed, latencies, hits)
+
+
+def bench_pipeline(config_file, searches, workers, staged=True):
+    steam_api = api.SteamApi(config_file)
+    steam_api.config['pipeline'] = staged
+    latencies = []
+    instrument(steam_api, latencies)
+    start_time = time.perf_counter()
+    steam_api.get_data_write_df(searches, workers, refresh=True)
+    elapsed = time.perf_counter() - start_time
+    hits = steam_api.journal.number_hits
+    name = 'staged_pipeline' if staged else 'sequential_phases'
+    return get_result(name, workers, elapsed, latencies, hits)
+
+
+def print_results(results, cols=None):
+    if cols is None:
+        cols = ['benchmark', 'workers', 'requests', 'hits', 'seconds',
+                'requests_per_sec', 'hits_per_sec', 'p50_ms', 'p99_ms',
+                'peak_rss_mb']
+    print(' '.join('{:>17}'.format(x) for x in cols))
+    for result in results:
+        print(' '.join('{:>17.2f}'.format(result[x])
+                       if isinstance(result[x], float)
+                       else '{:>17}'.format(result[x]) for x in cols))
+    sys.stdout.flush()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--hit_density', type=float, default=0.2)
+    parser.add_argument('--total_users', type=int, default=10 ** 6)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--rate_limit', type=float)
+    parser.add_argument('--malformed_rate', type=float, default=0.0)
+    parser.add_argument('--density_skew', type=float, default=0.0)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--json', metavar='FILE')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    config = sim.SimulatorConfig(
+        hit_density=args.hit_density, total_users=args.total_users,
+        latency=args.latency, rate_limit=args.rate_limit,
+        malformed_rate=args.malformed_rate, density_skew=args.density_skew)
+    process, base_url = sim.start_process(config)
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='steam_bench_')
+    results = []
+    try:
+        os.chdir(work_dir)
+        pool_size = (max(args.workers) + 1 +
+                     2 * api.SteamApi.default_stage_workers)
+        config_file = write_config(base_url, pool_size)
+        for workers in args.workers:
+            results.append(bench_search(config_file, args.searches, workers,
+                                        config.last_steam_id))
+        if args.pipeline:
+            for staged in [False, True]:
+                results.append(bench_pipeline(config_file, args.searches,
+                                              max(args.workers), staged))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        process.terminate()
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
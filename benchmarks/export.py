@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import steam.export as exp
+import steam.output as out
+from benchmarks.crawler import get_peak_rss, print_results
+
+first_steam_id = 76561197960265729
+
+schema_config = [
+    {'Table': 'game', 'PK': 'gameid:appid',
+     'Columns': 'appid BIGINT,gamename TEXT', 'FK': None},
+    {'Table': 'user', 'PK': 'userid:steam_id',
+     'Columns': 'steam_id BIGINT,personaname TEXT,loccountrycode TEXT',
+     'FK': None},
+    {'Table': 'gameevents', 'PK': 'gameeventsid:gameeventname',
+     'Columns': 'gameeventname TEXT,gameeventdate DATE,current_players INT',
+     'FK': 'game:gameid:appid,user:userid:steam_id'}]
+
+translation_config = [
+    {'DB': 'appid', 'DF': 'appid', 'TYPE': 'BIGINT'},
+    {'DB': 'gamename', 'DF': 'name', 'TYPE': 'TEXT'},
+    {'DB': 'steam_id', 'DF': 'steam_id', 'TYPE': 'BIGINT'},
+    {'DB': 'personaname', 'DF': 'personaname', 'TYPE': 'TEXT'},
+    {'DB': 'loccountrycode', 'DF': 'loccountrycode', 'TYPE': 'TEXT'},
+    {'DB': 'current_players', 'DF': 'player_count', 'TYPE': 'INT'},
+    {'DB': 'gameeventdate', 'DF': 'gameeventdate', 'TYPE': 'DATE'}]
+
+
+def write_config(upsert=False, batch_rows=None):
+    os.makedirs('cfg')
+    db_config = {'BACKEND': 'sqlite',
+                 'DATABASE': os.path.join('data', 'steam.db'),
+                 'UPSERT': upsert, 'BATCH_ROWS': batch_rows}
+    with open(os.path.join('cfg', 'db_sqlite.json'), 'w') as f:
+        json.dump(db_config, f)
+    pd.DataFrame(schema_config).to_csv(os.path.join('cfg', 'schema.csv'),
+                                       index=False)
+    pd.DataFrame(translation_config).to_csv(
+        os.path.join('cfg', 'translation.csv'), index=False)
+    return 'db_sqlite.json', 'schema.csv', 'translation.csv'
+
+
+def get_crawl_chunk(start, rows, games_per_user=10, app_count=50000,
+                    seed=0):
+    rand = np.random.RandomState(seed + start)
+    idx = np.arange(start, start + rows)
+    user = idx // games_per_user
+    appid = (user * 7919 + idx % games_per_user * 104729) % app_count + 1
+    df = pd.DataFrame({
+        'appid': appid,
+        'name': ['Game {}'.format(x) for x in appid],
+        'playtime_forever': rand.randint(0, 10 ** 5, rows),
+        'steam_id': first_steam_id + user,
+        'personaname': ['user{}'.format(x) for x in user],
+        'loccountrycode': np.array(['US', 'DE', 'BR', 'CN'])[user % 4],
+        'player_count': rand.randint(0, 10 ** 5, rows),
+        'gameeventdate': '2024-01-01 00:00:00'})
+    return df
+
+
+def write_crawl_file(file_name, rows, output_format=out.csv_format,
+                     chunk_size=10 ** 6):
+    df = get_crawl_chunk(0, 0)
+    writer = out.get_writer(output_format, file_name, columns=df.columns)
+    for start in range(0, rows, chunk_size):
+        writer.write(get_crawl_chunk(start, min(chunk_size, rows - start)))
+    writer.finalize()
+    return file_name
+
+
+def bench_upload(name, configs, data_file, rows, chunksize):
+    db_file, schema_file, translation_file = configs
+    start_time = time.perf_counter()
+    exp.DBUpload().upload_to_db(db_file, schema_file, translation_file,
+                                data_file, chunksize)
+    elapsed = time.perf_counter() - start_time
+    return {'benchmark': name, 'rows': rows, 'seconds': elapsed,
+            'rows_per_sec': rows / elapsed,
+            'file_mb': os.path.getsize(data_file) / 1048576.0,
+            'db_mb': os.path.getsize(os.path.join('data', 'steam.db')) /
+            1048576.0,
+            'peak_rss_mb': get_peak_rss()}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10 ** 4, 10 ** 5])
+    parser.add_argument('--format', choices=out.output_formats,
+                        default=out.csv_format)
+    parser.add_argument('--chunksize', type=int)
+    parser.add_argument('--batch_rows', type=int)
+    parser.add_argument('--upsert', action='store_true')
+    parser.add_argument('--json', metavar='FILE')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='steam_bench_')
+    results = []
+    try:
+        os.chdir(work_dir)
+        configs = write_config(args.upsert, args.batch_rows)
+        for rows in args.rows:
+            os.makedirs('data')
+            data_file = write_crawl_file(os.path.join(
+                'data', 'steam_users.{}'.format(args.format)), rows,
+                args.format)
+            chunksize = args.chunksize
+            if chunksize is None and rows > 10 ** 6:
+                chunksize = 10 ** 6
+            results.append(bench_upload('initial_upload', configs,
+                                        data_file, rows, chunksize))
+            results.append(bench_upload('repeat_upload', configs,
+                                        data_file, rows, chunksize))
+            shutil.rmtree('data')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(results, ['benchmark', 'rows', 'seconds', 'rows_per_sec',
+                            'file_mb', 'db_mb', 'peak_rss_mb'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import sys
+import time
+import argparse
+import pandas as pd
+import steam.utils as utl
+
+row_counts = [10 ** 3, 10 ** 4, 10 ** 5]
+
+
+def make_record(idx):
+    return {'appid': idx % 5000, 'playtime_forever': idx,
+            'steam_id': 76561197960265729 + idx}
+
+
+def frame_append(n):
+    df = pd.DataFrame()
+    for idx in range(n):
+        tdf = pd.DataFrame([make_record(idx)])
+        df = pd.concat([df, tdf], ignore_index=True, sort=True)
+    return df
+
+
+def record_buffer(n):
+    buffer = utl.RecordBuffer()
+    for idx in range(n):
+        buffer.append(make_record(idx))
+    return buffer.to_df()
+
+
+def time_method(method, n):
+    start = time.perf_counter()
+    df = method(n)
+    elapsed = time.perf_counter() - start
+    assert len(df) == n
+    return elapsed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_append_rows', type=int, default=10 ** 4)
+    args = parser.parse_args(args)
+    print('{:>16} {:>10} {:>12} {:>14}'.format(
+        'method', 'rows', 'seconds', 'us_per_row'))
+    for n in row_counts:
+        methods = [record_buffer]
+        if n <= args.max_append_rows:
+            methods.append(frame_append)
+        for method in methods:
+            elapsed = time_method(method, n)
+            print('{:>16} {:>10} {:>12.3f} {:>14.2f}'.format(
+                method.__name__, n, elapsed, elapsed / n * 10 ** 6))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
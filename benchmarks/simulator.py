@@ -0,0 +1,206 @@
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse as urlparse
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+first_steam_id = 76561197960265729
+
+
+class SimulatorConfig(object):
+    def __init__(self, hit_density=0.2, total_users=10 ** 6, app_count=500,
+                 games_per_hit=10, latency=0.05, latency_sigma=0.5,
+                 rate_limit=None, retry_after=1, malformed_rate=0.0,
+                 density_skew=0.0, seed=0):
+        self.hit_density = hit_density
+        self.total_users = total_users
+        self.app_count = app_count
+        self.games_per_hit = games_per_hit
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self.density_skew = density_skew
+        self.seed = seed
+
+    @property
+    def last_steam_id(self):
+        return first_steam_id + self.total_users
+
+    def get_hit_density(self, steam_id):
+        if not self.density_skew:
+            return self.hit_density
+        position = float(steam_id - first_steam_id) / self.total_users
+        skew = self.density_skew
+        density = self.hit_density * (1 + skew) * (1 - position) ** skew
+        return min(density, 1.0)
+
+
+class SteamSimulator(object):
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.next_time = time.time()
+        self.random = random.Random(config.seed)
+        self.routes = {
+            '/IPlayerService/GetOwnedGames/v0001/': self.owned_games,
+            '/ISteamUser/GetPlayerSummaries/v2/': self.player_summaries,
+            '/ISteamUserStats/GetNumberOfCurrentPlayers/v1/':
+                self.current_players,
+            '/ISteamApps/GetAppList/v0001/': self.app_list,
+            '/api/appdetails/': self.app_details}
+
+    def get_random(self, *keys):
+        key = '{}:{}'.format(self.config.seed, ':'.join(str(x) for x in keys))
+        seed = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+        return random.Random(seed)
+
+    def wait_latency(self):
+        with self.lock:
+            latency = self.random.lognormvariate(0, self.config.latency_sigma)
+        time.sleep(self.config.latency * latency)
+
+    def is_throttled(self):
+        if not self.config.rate_limit:
+            return False
+        with self.lock:
+            now = time.time()
+            if self.next_time - now > 1:
+                return True
+            self.next_time = (max(self.next_time, now) +
+                              1.0 / self.config.rate_limit)
+        return False
+
+    def is_malformed(self):
+        with self.lock:
+            return self.random.random() < self.config.malformed_rate
+
+    def owned_games(self, params):
+        steam_id = int(params['steamid'])
+        if steam_id > self.config.last_steam_id:
+            return 400, None
+        rand = self.get_random('user', steam_id)
+        if rand.random() >= self.config.get_hit_density(steam_id):
+            return 200, {'response': {}}
+        game_count = rand.randint(1, self.config.games_per_hit * 2)
+        appids = rand.sample(range(1, self.config.app_count + 1),
+                             min(game_count, self.config.app_count))
+        games = [{'appid': x, 'playtime_forever': rand.randint(0, 10 ** 5)}
+                 for x in appids]
+        return 200, {'response': {'game_count': len(games), 'games': games}}
+
+    def player_summaries(self, params):
+        players = []
+        for steam_id in params['steamids'].split(','):
+            rand = self.get_random('player', steam_id)
+            players.append({
+                'steamid': steam_id, 'communityvisibilitystate': 3,
+                'profilestate': 1, 'personaname': 'user{}'.format(steam_id),
+                'lastlogoff': rand.randint(10 ** 9, 2 * 10 ** 9),
+                'personastate': rand.randint(0, 6),
+                'loccountrycode': rand.choice(['US', 'DE', 'BR', 'CN'])})
+        return 200, {'response': {'players': players}}
+
+    def current_players(self, params):
+        rand = self.get_random('players', params['appid'], time.time() // 60)
+        return 200, {'response': {'player_count': rand.randint(0, 10 ** 5),
+                                  'result': 1}}
+
+    def app_list(self, params):
+        apps = [{'appid': x, 'name': 'Game {}'.format(x)}
+                for x in range(1, self.config.app_count + 1)]
+        return 200, {'applist': {'apps': {'app': apps}}}
+
+    def app_details(self, params):
+        appid = params['appids']
+        rand = self.get_random('app', appid)
+        data = {'steam_appid': int(appid), 'name': 'Game {}'.format(appid),
+                'type': 'game', 'is_free': rand.random() < 0.1,
+                'detailed_description': 'x' * rand.randint(100, 5000),
+                'categories': [{'id': 2, 'description': 'Single-player'}],
+                'genres': [{'id': '1', 'description': 'Action'}]}
+        return 200, {appid: {'success': True, 'data': data}}
+
+    def handle(self, path, params):
+        if path not in self.routes:
+            return 404, None, None
+        self.wait_latency()
+        if self.is_throttled():
+            return 429, None, self.config.retry_after
+        status, body = self.routes[path](params)
+        if status == 200 and self.is_malformed():
+            body = '<html>Simulated error</html>'
+            return status, body, None
+        return status, body, None
+
+
+def get_handler(simulator):
+    class SimulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            params = dict(urlparse.parse_qsl(url.query))
+            status, body, retry_after = simulator.handle(url.path, params)
+            if body is None:
+                body = '<html>Error {}</html>'.format(status)
+            elif not isinstance(body, str):
+                body = json.dumps(body)
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if retry_after is not None:
+                self.send_header('Retry-After', str(retry_after))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SimulatorHandler
+
+
+def serve(config, host='127.0.0.1', port=0, port_queue=None):
+    simulator = SteamSimulator(config)
+    server = ThreadingHTTPServer((host, port), get_handler(simulator))
+    server.daemon_threads = True
+    if port_queue is not None:
+        port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_process(config, host='127.0.0.1'):
+    port_queue = mp.Queue()
+    process = mp.Process(target=serve, args=(config, host, 0, port_queue),
+                         daemon=True)
+    process.start()
+    port = port_queue.get(timeout=30)
+    return process, 'http://{}:{}/'.format(host, port)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--hit_density', type=float, default=0.2)
+    parser.add_argument('--total_users', type=int, default=10 ** 6)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rate_limit', type=float)
+    parser.add_argument('--malformed_rate', type=float, default=0.0)
+    parser.add_argument('--density_skew', type=float, default=0.0)
+    args = parser.parse_args(args)
+    config = SimulatorConfig(
+        hit_density=args.hit_density, total_users=args.total_users,
+        latency=args.latency, rate_limit=args.rate_limit,
+        malformed_rate=args.malformed_rate, density_skew=args.density_skew)
+    print('Serving simulated Steam API on port {}'.format(args.port))
+    serve(config, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
+import os
 import sys
 import logging
 import argparse
 import steam.export as exp
+import steam.output as out
+import steam.metrics as mtr
+import steam.profiler as prf
 import steam.steamapi as api
+import steam.daemon as dmn
 
 
 def set_log():
@@ -25,19 +30,49 @@ def set_log():
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--loop', metavar='N', type=int)
+parser.add_argument('--workers', metavar='N', type=int)
 parser.add_argument('--nopull', action='store_true')
+parser.add_argument('--refresh', action='store_true')
+parser.add_argument('--resume', action='store_true')
+parser.add_argument('--format', choices=out.output_formats)
 parser.add_argument('--exp', choices=['all', 'db', 'ftp'])
+parser.add_argument('--full', action='store_true')
+parser.add_argument('--daemon', action='store_true')
+parser.add_argument('--metrics', metavar='FILE',
+                    default=os.path.join('data', 'metrics.json'))
+parser.add_argument('--prom', metavar='FILE')
+parser.add_argument('--profile', nargs='?', const=prf.Profiler.cprofile,
+                    choices=prf.Profiler.modes)
+parser.add_argument('--profile_dir', metavar='DIR')
 args = parser.parse_args()
 
 
 def main():
     set_log()
-    if not args.nopull:
-        steam_api = api.SteamApi()
-        steam_api.get_data_write_df(args.loop)
-    if args.exp:
-        exp_class = exp.ExportHandler()
-        exp_class.export_loop(args.exp)
+    profiler = None
+    if args.profile:
+        profiler = prf.Profiler(args.profile_dir, args.profile)
+        profiler.start()
+    try:
+        if args.daemon:
+            daemon = dmn.PlayerCountDaemon(api.SteamApi(), args.metrics,
+                                           args.prom)
+            daemon.run()
+            return None
+        if not args.nopull:
+            with prf.phase('crawl'):
+                steam_api = api.SteamApi()
+                steam_api.get_data_write_df(args.loop, args.workers,
+                                            args.refresh, args.resume,
+                                            args.format)
+        if args.exp:
+            with prf.phase('export'):
+                exp_class = exp.ExportHandler()
+                exp_class.export_loop(args.exp, args.full)
+    finally:
+        if profiler:
+            profiler.stop()
+        mtr.registry.write(args.metrics, args.prom)
 
 
 if __name__ == '__main__':
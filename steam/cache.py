@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+import hashlib
+import steam.utils as utl
+
+
+class AppDetailsCache(object):
+    default_ttl = 24 * 30
+    query_size = 500
+
+    def __init__(self, cache_file, ttl=None):
+        self.cache_file = cache_file
+        self.ttl = ttl if ttl is not None else self.default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.changed = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connect()
+
+    def connect(self):
+        dir_name = os.path.dirname(self.cache_file)
+        if dir_name:
+            utl.dir_check(dir_name)
+        self.connection = sqlite3.connect(self.cache_file,
+                                          check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS app_details (
+             appid INTEGER PRIMARY KEY,
+             fetched REAL NOT NULL,
+             hash TEXT,
+             data TEXT)
+            """)
+        self.connection.commit()
+
+    @staticmethod
+    def get_hash(data):
+        data = json.dumps(data, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest(), data
+
+    def get_fresh(self, appids):
+        min_fetched = time.time() - (self.ttl * 60 * 60)
+        appids = [int(x) for x in appids]
+        cached = {}
+        for idx in range(0, len(appids), self.query_size):
+            chunk = appids[idx:idx + self.query_size]
+            command = """
+                      SELECT appid, data
+                       FROM app_details
+                       WHERE fetched >= ?
+                       AND appid IN ({})
+                      """.format(', '.join(['?'] * len(chunk)))
+            with self.lock:
+                rows = self.connection.execute(
+                    command, [min_fetched] + chunk).fetchall()
+            for appid, data in rows:
+                cached[appid] = json.loads(data) if data else None
+        with self.lock:
+            self.hits += len(cached)
+            self.misses += len(set(appids)) - len(cached)
+        return cached
+
+    def add_misses(self, appids):
+        with self.lock:
+            self.misses += len(set(int(x) for x in appids))
+
+    def set(self, appid, data):
+        data_hash, data = self.get_hash(data) if data else (None, None)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT hash FROM app_details WHERE appid = ?',
+                (int(appid),)).fetchone()
+            if row and row[0] != data_hash:
+                self.changed += 1
+            self.connection.execute("""
+                INSERT OR REPLACE INTO app_details (appid, fetched, hash, data)
+                 VALUES (?, ?, ?, ?)
+                """, (int(appid), time.time(), data_hash, data))
+
+    def get_appids(self):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT appid FROM app_details WHERE data IS NOT NULL')
+            return [x[0] for x in rows.fetchall()]
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def log_report(self):
+        total = self.hits + self.misses
+        hit_rate = (float(self.hits) / total * 100) if total else 0
+        logging.info('App details cache hits: {} misses: {} ({:.1f}% hit '
+                     'rate) changed on refetch: {}'.format(
+                      self.hits, self.misses, hit_rate, self.changed))
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,193 @@
+import time
+import heapq
+import queue
+import signal
+import logging
+import threading
+import pandas as pd
+import steam.export as exp
+import steam.steamapi as api
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PlayerCountDaemon(object):
+    default_tiers = [[10000, 5], [1000, 15], [100, 60], [0, 360]]
+    default_poll_rate = 1.0
+    default_workers = 4
+    default_flush_interval = 300
+    default_track_interval = 3600
+    default_max_records = 10 ** 6
+    max_wait = 1.0
+    retry_base = 30
+
+    def __init__(self, steam_api, metrics_file=None, prometheus_file=None):
+        self.steam_api = steam_api
+        config = steam_api.config.get('daemon', {})
+        self.tiers = sorted(config.get('tiers', self.default_tiers),
+                            reverse=True)
+        self.poll_rate = config.get('poll_rate', self.default_poll_rate)
+        self.workers = config.get('workers', self.default_workers)
+        self.flush_interval = config.get('flush_interval',
+                                         self.default_flush_interval)
+        self.track_interval = config.get('track_interval',
+                                         self.default_track_interval)
+        self.max_records = config.get('max_records',
+                                      self.default_max_records)
+        self.static_appids = set(config.get('tracked_appids', []))
+        self.export_key = config.get('export_key')
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.metrics = steam_api.metrics
+        self.steam_api.rate_limiter = api.RateLimiter(self.poll_rate)
+        self.schedule = []
+        self.intervals = {}
+        self.failures = {}
+        self.demand = 0.0
+        self.results = queue.Queue()
+        self.records = []
+        self.in_flight = 0
+        self.uploader = None
+        self.running = False
+
+    def get_interval(self, player_count):
+        for min_players, interval in self.tiers:
+            if player_count >= min_players:
+                return interval * 60
+        return self.tiers[-1][1] * 60
+
+    def set_interval(self, appid, interval):
+        if appid in self.intervals:
+            self.demand -= 1.0 / self.intervals[appid]
+        self.demand += 1.0 / interval
+        self.intervals[appid] = interval
+
+    def get_stretch(self):
+        return max(1.0, self.demand / self.poll_rate)
+
+    def track_apps(self):
+        appids = set(self.steam_api.app_cache.get_appids())
+        appids = sorted((appids | self.static_appids) - set(self.intervals))
+        now = time.time()
+        offset = len(self.schedule) / float(self.poll_rate)
+        for idx, appid in enumerate(appids):
+            self.set_interval(appid, self.tiers[-1][1] * 60)
+            heapq.heappush(self.schedule,
+                           (now + offset + idx / float(self.poll_rate),
+                            appid))
+        logging.info('Tracking {} apps ({} new).  Polling demand {:.2f}/s '
+                     'against a budget of {}/s.'.format(
+                         len(self.intervals), len(appids), self.demand,
+                         self.poll_rate))
+
+    def poll(self, appid):
+        try:
+            records = self.steam_api.request_current_players([appid])
+        except Exception:
+            logging.exception('Polling {} failed.'.format(appid))
+            records = []
+        self.results.put((appid, records, pd.Timestamp.now()))
+
+    def handle_result(self, result):
+        appid, records, poll_time = result
+        self.in_flight -= 1
+        player_count = records[0]['player_count'] if records else None
+        self.metrics.inc('steam_daemon_polls_total',
+                         result='ok' if records else 'failed')
+        if records:
+            self.failures.pop(appid, None)
+            self.records.append({'appid': appid, 'steam_id': None,
+                                 'player_count': player_count,
+                                 'gameeventdate': poll_time})
+            self.set_interval(appid, self.get_interval(player_count))
+            wait = self.intervals[appid] * self.get_stretch()
+        else:
+            failures = self.failures.get(appid, 0)
+            self.failures[appid] = failures + 1
+            wait = min(self.retry_base * 2 ** failures,
+                       self.intervals[appid])
+        next_time = time.time() + wait
+        heapq.heappush(self.schedule, (next_time, appid))
+
+    def wait_results(self, timeout):
+        try:
+            result = self.results.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return None
+        self.handle_result(result)
+        while True:
+            try:
+                self.handle_result(self.results.get_nowait())
+            except queue.Empty:
+                return None
+
+    def flush(self):
+        if self.records:
+            records = self.records
+            self.records = []
+            try:
+                rows = self.uploader.upload_df(pd.DataFrame(records))
+            except Exception:
+                logging.exception('Writing player counts failed.  Keeping '
+                                  '{} row(s) for the next flush.'.format(
+                                      len(records)))
+                self.uploader.db.reset()
+                self.records = records + self.records
+                self.trim_records()
+                return None
+            self.metrics.inc('steam_daemon_rows_total', rows)
+            logging.info('Wrote {} player count(s) to gameevents.'.format(
+                rows))
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file, self.prometheus_file)
+
+    def trim_records(self):
+        dropped = len(self.records) - self.max_records
+        if dropped > 0:
+            logging.warning('Dropping the {} oldest unwritten player '
+                            'count(s).'.format(dropped))
+            self.metrics.inc('steam_daemon_dropped_rows_total', dropped)
+            self.records = self.records[dropped:]
+
+    def stop(self, *args):
+        logging.info('Stopping player count daemon.')
+        self.running = False
+
+    def run(self, duration=None):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        self.uploader = exp.ExportHandler().get_uploader(self.export_key)
+        self.running = True
+        start_time = time.time()
+        next_track = start_time
+        next_flush = start_time + self.flush_interval
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while self.running:
+                now = time.time()
+                if duration is not None and now - start_time >= duration:
+                    break
+                if now >= next_track:
+                    self.track_apps()
+                    next_track = now + self.track_interval
+                if now >= next_flush:
+                    self.flush()
+                    next_flush = now + self.flush_interval
+                if (self.schedule and self.schedule[0][0] <= now and
+                        self.in_flight < self.workers * 2):
+                    _, appid = heapq.heappop(self.schedule)
+                    self.in_flight += 1
+                    executor.submit(self.poll, appid)
+                    self.wait_results(0)
+                    continue
+                wait_until = min(next_track, next_flush, now + self.max_wait)
+                if self.schedule and self.in_flight < self.workers * 2:
+                    wait_until = min(wait_until, self.schedule[0][0])
+                self.wait_results(wait_until - now)
+        except KeyboardInterrupt:
+            self.stop()
+        finally:
+            executor.shutdown(wait=True)
+            self.wait_results(0)
+            self.flush()
+            self.uploader.close()
+            self.steam_api.app_cache.close()
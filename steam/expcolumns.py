@@ -4,6 +4,7 @@ output_file = 'Output_File'
 config_file = 'Config_File'
 translation_file = 'Translation_File'
 schema_file = 'Schema_File'
+chunk_size = 'Chunk_Size'
 
 table = 'Table'
 pk = 'PK'
@@ -16,4 +17,7 @@ translation_db = 'DB'
 translation_df = 'DF'
 translation_type = 'TYPE'
 
+row_hash = 'rowhash'
+
+event_date = 'gameeventdate'
 event_dict = {'gameeventname': ['gameeventdate', 'appid', 'steam_id']}
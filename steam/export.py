@@ -1,27 +1,39 @@
 import os
 import io
+import copy
+import codecs
 import sys
-import math
 import json
 import time
 import logging
+import sqlite3
+import contextlib
 import numpy as np
 import pandas as pd
 import datetime as dt
 import sqlalchemy as sqa
 import steam.utils as utl
+import steam.output as out
 import steam.expcolumns as exc
 import steam.models as mdl
+import steam.metrics as mtr
+import steam.profiler as prf
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 log = logging.getLogger()
 config_path = utl.config_path
+metadata_cache = {}
 
 
 class ExportHandler(object):
+    manifest_file = os.path.join('data', 'export_manifest.json')
+
     def __init__(self):
         self.export_list = None
         self.config = None
         self.args = None
+        self.full = False
+        self.manifest = {}
         self.config_file = os.path.join(config_path, 'export_handler.csv')
         self.load_config(self.config_file)
 
@@ -30,22 +42,86 @@ class ExportHandler(object):
         self.export_list = df[exc.export_key].tolist()
         self.config = df.set_index(exc.export_key).to_dict()
 
-    def export_loop(self, args):
+    def export_loop(self, args, full=False):
         self.args = args
+        self.full = full
+        self.load_manifest()
         for exp_key in self.export_list:
             self.export_item_check_type(exp_key)
 
+    def load_manifest(self):
+        if os.path.isfile(self.manifest_file):
+            self.manifest = utl.load_config_file(self.manifest_file)
+        else:
+            self.manifest = {}
+
+    def get_watermark(self, exp_key, file_hash):
+        if self.full or exp_key not in self.manifest:
+            return None
+        if self.manifest[exp_key]['file_hash'] == file_hash:
+            return False
+        watermark = self.manifest[exp_key].get('watermark')
+        if watermark:
+            watermark = pd.Timestamp(watermark)
+        return watermark
+
+    def update_manifest(self, exp_key, file_hash, watermark):
+        old_watermark = self.manifest.get(exp_key, {}).get('watermark')
+        if watermark is not None and not pd.isnull(watermark):
+            watermark = pd.Timestamp(watermark).isoformat()
+        else:
+            watermark = old_watermark
+        if old_watermark and watermark and old_watermark > watermark:
+            watermark = old_watermark
+        self.manifest[exp_key] = {'file_hash': file_hash,
+                                  'watermark': watermark,
+                                  'exported': dt.datetime.today().isoformat()}
+        utl.write_config_file(self.manifest_file, self.manifest)
+
     def export_item_check_type(self, exp_key):
         if (self.config[exc.export_type][exp_key] == 'DB' and
            (self.args == 'db' or self.args == 'all')):
             self.export_db(exp_key)
 
+    def get_db_key(self):
+        for exp_key in self.export_list:
+            if self.config[exc.export_type][exp_key] == 'DB':
+                return exp_key
+        return None
+
+    def get_uploader(self, exp_key=None):
+        exp_key = exp_key or self.get_db_key()
+        if exp_key is None:
+            logging.error('No DB export in {}.  Aborting.'.format(
+                self.config_file))
+            sys.exit(0)
+        dbu = DBUpload()
+        dbu.connect(self.config[exc.config_file][exp_key],
+                    self.config[exc.schema_file][exp_key],
+                    self.config[exc.translation_file][exp_key])
+        return dbu
+
+    def get_chunk_size(self, exp_key):
+        chunksize = self.config.get(exc.chunk_size, {}).get(exp_key)
+        if chunksize and not pd.isnull(chunksize):
+            return int(chunksize)
+        return None
+
     def export_db(self, exp_key):
+        data_file = self.config[exc.output_file][exp_key]
+        file_hash = utl.get_file_hash(data_file)
+        watermark = self.get_watermark(exp_key, file_hash)
+        if watermark is False:
+            logging.info('{} unchanged since last export for {}.  '
+                         'Skipping.'.format(data_file, exp_key))
+            return None
         dbu = DBUpload()
-        dbu.upload_to_db(self.config[exc.config_file][exp_key],
-                         self.config[exc.schema_file][exp_key],
-                         self.config[exc.translation_file][exp_key],
-                         self.config[exc.output_file][exp_key])
+        max_date = dbu.upload_to_db(self.config[exc.config_file][exp_key],
+                                    self.config[exc.schema_file][exp_key],
+                                    self.config[exc.translation_file][exp_key],
+                                    data_file, self.get_chunk_size(exp_key),
+                                    watermark)
+        self.update_manifest(exp_key, file_hash, max_date)
 
 
 class DBUpload(object):
@@ -57,33 +133,102 @@ class DBUpload(object):
         self.id_col = None
         self.name = None
         self.values = None
+        self.metrics = mtr.registry
+
+    def upload_to_db(self, db_file, schema_file, translation_file, data_file,
+                     chunksize=None, watermark=None):
+        with prf.phase('upload', self.metrics), get_db(db_file) as self.db:
+            logging.info('Uploading {} to {}'.format(data_file, self.db.db))
+            self.dbs = DBSchema(schema_file)
+            self.dft = DFTranslation(translation_file, data_file, self.db,
+                                     chunksize, watermark)
+            if chunksize:
+                for idx, df in enumerate(self.dft.get_chunks()):
+                    logging.info('Uploading chunk {} of {} rows.'.format(
+                        idx, len(df)))
+                    self.upload_tables()
+            else:
+                self.upload_tables()
+            logging.info('{} successfully uploaded to {}'.format(
+                data_file, self.db.db))
+        return self.dft.max_date
 
-    def upload_to_db(self, db_file, schema_file, translation_file, data_file):
-        self.db = DB(db_file)
-        logging.info('Uploading {} to {}'.format(data_file, self.db.db))
+    def connect(self, db_file, schema_file, translation_file):
+        self.db = get_db(db_file)
         self.dbs = DBSchema(schema_file)
-        self.dft = DFTranslation(translation_file, data_file, self.db)
-        for table in self.dbs.table_list:
-            self.upload_table_to_db(table)
-        logging.info('{} successfully uploaded to {}'.format(data_file,
-                                                             self.db.db))
+        self.dft = DFTranslation(translation_file, None, self.db)
+
+    def upload_df(self, df):
+        with prf.phase('upload', self.metrics):
+            self.dft.set_df(df)
+            if not self.dft.df.empty:
+                self.upload_tables()
+        return len(self.dft.df)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def upload_tables(self):
+        if not self.db.parallel or len(self.dbs.table_list) < 2:
+            for table in self.dbs.table_list:
+                self.upload_table_to_db(table)
+            return None
+        dependencies = self.dbs.get_dependencies()
+        pending = list(self.dbs.table_list)
+        uploaded = set()
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.db.pool_size) as executor:
+            while pending or futures:
+                ready = [x for x in pending if dependencies[x] <= uploaded]
+                for table in ready:
+                    pending.remove(table)
+                    future = executor.submit(self.upload_table_worker, table)
+                    futures[future] = table
+                if not futures:
+                    logging.error('Circular foreign keys in tables: '
+                                  '{}'.format(pending))
+                    sys.exit(0)
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    uploaded.add(futures.pop(future))
+
+    def upload_table_worker(self, table):
+        worker = DBUpload()
+        worker.dbs = copy.copy(self.dbs)
+        worker.dft = self.dft
+        with self.db.clone() as worker.db:
+            worker.upload_table_to_db(table)
 
     def upload_table_to_db(self, table):
         logging.info('Uploading table {} to {}'.format(table, self.db.db))
-        ul_df = self.get_upload_df(table)
-        if ul_df.empty:
-            return None
-        self.dbs.set_table(table)
-        pk_config = {table: list(self.dbs.pk.items())[0]}
-        self.set_id_info(table, pk_config, ul_df)
-        where_col = self.name
-        where_val = self.values
-        df_rds = self.read_rds_table(table, list(ul_df.columns),
-                                     where_col, where_val)
-        df = pd.merge(df_rds, ul_df, how='outer', on=self.name, indicator=True)
-        df = df.drop_duplicates(self.name).reset_index()
-        self.update_rows(df, df_rds.columns, table)
-        self.insert_rows(df, table)
+        timer = self.metrics.timer('steam_db_table_seconds',
+                                   mtr.duration_buckets, table=table)
+        with timer, self.db.transaction():
+            ul_df = self.get_upload_df(table)
+            if ul_df.empty:
+                return None
+            self.dbs.set_table(table)
+            pk_config = {table: list(self.dbs.pk.items())[0]}
+            self.set_id_info(table, pk_config, ul_df)
+            if exc.row_hash in self.db.get_table_columns(table):
+                ul_df = self.add_row_hash(ul_df)
+            if self.db.upsert:
+                self.upsert_rows(ul_df, table)
+                return None
+            if exc.row_hash in ul_df.columns:
+                self.upload_rows_by_hash(ul_df, table)
+                return None
+            where_col = self.name
+            where_val = self.values
+            df_rds = self.read_rds_table(table, list(ul_df.columns),
+                                         where_col, where_val)
+            df = pd.merge(df_rds, ul_df, how='outer', on=self.name,
+                          indicator=True)
+            df = df.drop_duplicates(self.name).reset_index()
+            self.update_rows(df, df_rds, ul_df, table)
+            self.insert_rows(df, table)
 
     def get_upload_df(self, table):
         cols = self.dbs.get_cols_for_export(table)
@@ -98,36 +243,61 @@ class DBUpload(object):
         df_rds = self.dft.clean_types_for_upload(df_rds)
         return df_rds
 
-    def update_rows(self, df, cols, table):
+    @staticmethod
+    def get_row_hash(df, cols):
+        row_hash = pd.util.hash_pandas_object(df[cols], index=False)
+        return row_hash.values.view('int64')
+
+    def add_row_hash(self, df):
+        hash_cols = [x for x in df.columns
+                     if x not in [self.id_col, exc.row_hash]]
+        df = df.drop_duplicates(self.name, keep='last').copy()
+        df[exc.row_hash] = self.get_row_hash(df, hash_cols)
+        return df
+
+    def get_key_hash(self, df, cols):
+        df = df.drop_duplicates(self.name)
+        return pd.Series(self.get_row_hash(df, cols), index=df[self.name])
+
+    def update_rows(self, df, df_rds, ul_df, table):
         df_update = df[df['_merge'] == 'both']
-        updated_index = []
-        set_cols = [x for x in cols if x not in [self.name, self.id_col]]
-        for col in set_cols:
-            df_changed = (df_update[df_update[col + '_y'] !=
-                                    df_update[col + '_x']]
-                          [[self.name, col + '_y']])
-            updated_index.extend(df_changed.index)
-        if updated_index:
+        set_cols = [x for x in df_rds.columns
+                    if x not in [self.name, self.id_col]]
+        if df_update.empty or not set_cols:
+            return None
+        keys = df_update[self.name]
+        old_hash = keys.map(self.get_key_hash(df_rds, set_cols)).values
+        new_hash = keys.map(self.get_key_hash(ul_df, set_cols)).values
+        df_update = df_update[old_hash != new_hash]
+        if not df_update.empty:
             df_update = self.get_right_df(df_update)
-            df_update = df_update.loc[updated_index]
             df_update = df_update[[self.name] + set_cols]
             set_vals = [tuple(x) for x in df_update.values]
-            set_vals = self.size_check_and_split(set_vals)
-            for set_val in set_vals:
-                self.db.update_rows(table, set_cols, set_val, self.name)
+            self.db.update_rows(table, set_cols, set_vals, self.name)
 
-    @staticmethod
-    def size_check_and_split(set_vals):
-        size = sys.getsizeof(set_vals)
-        max_mem = 1048576.0
-        lists_needed = size / max_mem
-        n = int(math.ceil(len(set_vals) / lists_needed))
-        set_vals = [set_vals[i:i + n] for i in range(0, len(set_vals), n)]
-        return set_vals
+    def upload_rows_by_hash(self, ul_df, table):
+        df_rds = self.db.read_rds(table, exc.row_hash, self.name, self.values)
+        df_rds = df_rds.drop_duplicates(self.name).set_index(self.name)
+        exists = ul_df[self.name].isin(df_rds.index)
+        df_update = ul_df[exists]
+        old_hash = df_update[self.name].map(df_rds[exc.row_hash]).values
+        df_update = df_update[old_hash != df_update[exc.row_hash].values]
+        logging.info('{} of {} existing row(s) changed in {}'.format(
+            len(df_update), exists.sum(), table))
+        set_cols = [x for x in ul_df.columns
+                    if x not in [self.name, self.id_col]]
+        if not df_update.empty:
+            df_update = df_update[[self.name] + set_cols]
+            set_vals = [tuple(x) for x in df_update.values]
+            self.db.update_rows(table, set_cols, set_vals, self.name)
+        self.insert_df(ul_df[~exists], table)
 
     def insert_rows(self, df, table):
         df_insert = df[df['_merge'] == 'right_only']
         df_insert = self.get_right_df(df_insert)
+        self.insert_df(df_insert, table)
+
+    def insert_df(self, df_insert, table):
         for fk_table in self.dbs.fk:
             col = self.dbs.fk[fk_table][0]
             if col in df_insert.columns:
@@ -137,6 +307,16 @@ class DBUpload(object):
         if not df_insert.empty:
             self.db.copy_from(table, df_insert, df_insert.columns)
 
+    def upsert_rows(self, df, table):
+        df = df.drop_duplicates(self.name, keep='last')
+        for fk_table in self.dbs.fk:
+            col = self.dbs.fk[fk_table][0]
+            if col in df.columns:
+                df = self.dft.df_col_to_type(df, col, 'INT')
+        if self.id_col in df.columns:
+            df = df.drop([self.id_col], axis=1)
+        self.db.upsert_from(table, df, self.name)
+
     def get_right_df(self, df):
         cols = [x for x in df.columns if x[-2:] == '_y']
         df = df[[self.name] + cols]
@@ -165,8 +345,53 @@ class DBUpload(object):
         self.values = sliced_df[self.name].tolist()
 
 
+class ByteBatcher(object):
+    default_max_bytes = 1048576
+    default_max_rows = 10000
+    value_overhead = 4
+
+    def __init__(self, max_bytes=None, max_rows=None):
+        self.max_bytes = max_bytes or self.default_max_bytes
+        self.max_rows = max_rows or self.default_max_rows
+
+    def get_row_size(self, row):
+        if not isinstance(row, (list, tuple)):
+            row = (row,)
+        return sum(len(str(x).encode('utf-8')) + self.value_overhead
+                   for x in row)
+
+    def get_batches(self, rows):
+        batch = []
+        batch_size = 0
+        for row in rows:
+            row_size = self.get_row_size(row)
+            if batch and (batch_size + row_size > self.max_bytes or
+                          len(batch) >= self.max_rows):
+                yield batch, batch_size
+                batch = []
+                batch_size = 0
+            batch.append(row)
+            batch_size += row_size
+        if batch:
+            yield batch, batch_size
+
+
 # noinspection SqlResolve
+def get_db(config=None):
+    if config:
+        db_config = utl.load_config_file(os.path.join(config_path, config))
+        if db_config.get('BACKEND', 'postgresql') == SQLiteDB.backend:
+            return SQLiteDB(config)
+    return DB(config)
+
+
 class DB(object):
+    backend = 'postgresql'
+    default_pool_size = 5
+    default_max_overflow = 5
+    default_fetch_size = 10000
+    key_filter = '= ANY(%s)'
+
     def __init__(self, config=None):
         self.user = None
         self.pw = None
@@ -181,10 +406,27 @@ class DB(object):
         self.cursor = None
         self.output = None
         self.conn_string = None
+        self.pool_size = self.default_pool_size
+        self.max_overflow = self.default_max_overflow
+        self.transaction_depth = 0
+        self.cursor_count = 0
+        self.metadata = None
+        self.batcher = ByteBatcher()
+        self.fetch_size = self.default_fetch_size
+        self.owns_engine = True
+        self.upsert = False
+        self.parallel = False
+        self.metrics = mtr.registry
         self.config = config
         if self.config:
             self.input_config(self.config)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def input_config(self, config):
         logging.info('Loading DB config file: {}'.format(config))
         self.configfile = os.path.join(config_path, config)
@@ -209,19 +451,46 @@ class DB(object):
             self.schema = self.db
         else:
             self.schema = self.config['SCHEMA']
+        self.load_options()
         self.config_list = [self.user, self.pw, self.host, self.port, self.db,
                             self.schema]
 
+    def load_options(self):
+        self.pool_size = self.config.get('POOL_SIZE', self.pool_size)
+        self.max_overflow = self.config.get('MAX_OVERFLOW', self.max_overflow)
+        self.upsert = self.config.get('UPSERT', self.upsert)
+        self.parallel = self.config.get('PARALLEL', self.parallel)
+        self.fetch_size = self.config.get('FETCH_SIZE', self.fetch_size)
+        self.batcher = ByteBatcher(self.config.get('BATCH_BYTES'),
+                                   self.config.get('BATCH_ROWS'))
+
     def check_config(self):
         for item in self.config_list:
             if item == '':
                 logging.warning(item + 'not in DB config file.  Aborting.')
                 sys.exit(0)
 
+    def get_engine(self):
+        if self.engine is None:
+            self.engine = sqa.create_engine(
+                self.conn_string, connect_args={'sslmode': 'prefer'},
+                pool_size=self.pool_size, max_overflow=self.max_overflow,
+                pool_pre_ping=True)
+        return self.engine
+
+    def is_closed(self):
+        if getattr(self.connection, 'dbapi_connection', True) is None:
+            return True
+        return bool(getattr(self.connection, 'closed', False))
+
     def connect(self):
+        if self.connection is not None:
+            if not self.is_closed():
+                return None
+            logging.warning('DB connection was closed.  Reconnecting.')
+            self.reset()
         logging.debug('Connecting to DB at Host: {}'.format(self.host))
-        self.engine = sqa.create_engine(self.conn_string,
-                                        connect_args={'sslmode': 'prefer'})
+        self.get_engine()
         try:
             self.connection = self.engine.raw_connection()
         except AssertionError:
@@ -232,6 +501,60 @@ class DB(object):
             self.connect()
         self.cursor = self.connection.cursor()
 
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connect()
+        self.transaction_depth += 1
+        try:
+            yield self
+            if self.transaction_depth == 1:
+                self.connection.commit()
+        except Exception:
+            if self.transaction_depth == 1:
+                self.connection.rollback()
+            raise
+        finally:
+            self.transaction_depth -= 1
+
+    def commit(self):
+        if not self.transaction_depth:
+            self.connection.commit()
+
+    def reset(self):
+        for item in [self.cursor, self.connection]:
+            if item is None:
+                continue
+            try:
+                item.close()
+            except Exception as e:
+                logging.debug('Error closing DB connection: {}'.format(e))
+        self.cursor = None
+        self.connection = None
+        self.transaction_depth = 0
+        self.cursor_count = 0
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.engine is not None and self.owns_engine:
+            self.engine.dispose()
+        self.engine = None
+
+    def clone(self):
+        db = copy.copy(self)
+        db.engine = self.get_engine()
+        db.owns_engine = False
+        db.connection = None
+        db.cursor = None
+        db.output = None
+        db.transaction_depth = 0
+        db.cursor_count = 0
+        return db
+
     def df_to_output(self, df):
         if sys.version_info[0] == 3:
             self.output = io.StringIO()
@@ -241,27 +564,96 @@ class DB(object):
                   encoding='utf-8')
         self.output.seek(0)
 
+    def record_write(self, table, action, rows, size, elapsed):
+        self.metrics.inc('steam_db_rows_total', rows, table=table,
+                         action=action)
+        self.metrics.inc('steam_db_bytes_sent_total', size, table=table)
+        self.metrics.observe('steam_db_batch_seconds', elapsed, table=table,
+                             action=action)
+
     def copy_from(self, table, df, columns):
         table_path = self.schema + '.' + table
         self.connect()
         logging.info('Writing {} row(s) to {}'.format(len(df), table))
         self.df_to_output(df)
+        start_time = time.time()
         cur = self.connection.cursor()
         cur.copy_from(self.output, table=table_path, columns=columns)
-        self.connection.commit()
+        self.record_write(table, 'insert', len(df), self.output.tell(),
+                          time.time() - start_time)
+        self.commit()
         cur.close()
 
-    def insert_rds(self, table, columns, values, return_col):
+    def upsert_from(self, table, df, where_col):
+        staging_table = 'staging_{}'.format(table)
+        columns = list(df.columns)
+        set_cols = [x for x in columns if x != where_col]
         self.connect()
+        logging.info('Upserting {} row(s) to {}'.format(len(df), table))
+        command = """
+                  CREATE TEMP TABLE {0}
+                   AS SELECT {1} FROM {2}.{3}
+                   WITH NO DATA
+                  """.format(staging_table, ', '.join(columns), self.schema,
+                             table)
+        self.cursor.execute(command)
+        self.df_to_output(df)
+        start_time = time.time()
+        self.cursor.copy_from(self.output, table=staging_table,
+                              columns=columns)
+        if set_cols:
+            conflict = """
+                       DO UPDATE
+                       SET {0}
+                       WHERE ({1}) IS DISTINCT FROM ({2})
+                       """.format(', '.join(x + ' = EXCLUDED.' + x
+                                            for x in set_cols),
+                                  ', '.join('t.' + x for x in set_cols),
+                                  ', '.join('EXCLUDED.' + x
+                                            for x in set_cols))
+        else:
+            conflict = 'DO NOTHING'
+        command = """
+                  INSERT INTO {0}.{1} AS t ({2})
+                   SELECT {2} FROM {3}
+                   ON CONFLICT ({4}) {5}
+                  """.format(self.schema, table, ', '.join(columns),
+                             staging_table, where_col, conflict)
+        self.cursor.execute(command)
+        self.cursor.execute('DROP TABLE {}'.format(staging_table))
+        self.record_write(table, 'upsert', len(df), self.output.tell(),
+                          time.time() - start_time)
+        self.commit()
+
+    def execute_batches(self, command, rows, table, action):
+        self.connect()
+        data = []
+        for batch, batch_size in self.batcher.get_batches(rows):
+            start_time = time.time()
+            self.cursor.execute(
+                command.format(', '.join(['%s'] * len(batch))), batch)
+            if self.cursor.description:
+                data.extend(self.cursor.fetchall())
+            elapsed = time.time() - start_time
+            self.record_write(table, action, len(batch), batch_size, elapsed)
+            logging.debug('{} batch of {} row(s) ({:.1f} KiB) in {} took '
+                          '{:.2f}s'.format(action, len(batch),
+                                           batch_size / 1024.0, table,
+                                           elapsed))
+        self.commit()
+        return data
+
+    def insert_rds(self, table, columns, values, return_col):
+        rows = values
+        if not values or not isinstance(values[0], (list, tuple)):
+            rows = [tuple(values)]
         command = """
                   INSERT INTO {0}.{1} ({2})
-                   VALUES ({3})
-                   RETURNING ({4})
+                   VALUES {{}}
+                   RETURNING ({3})
                   """.format(self.schema, table, ', '.join(columns),
-                             ', '.join(['%s'] * len(values)), return_col)
-        self.cursor.execute(command, values)
-        self.connection.commit()
-        data = self.cursor.fetchall()
+                             return_col)
+        data = self.execute_batches(command, rows, table, 'insert')
         data = pd.DataFrame(data=data, columns=[return_col])
         return data
 
@@ -269,130 +661,186 @@ class DB(object):
                     where_col2, where_vals2):
         logging.info('Deleting {} row(s) from {}'.format(len(where_vals2),
                                                          table))
-        self.connect()
         command = """
                   DELETE FROM {0}.{1}
                    WHERE {0}.{1}.{2} IN ({3})
-                   AND {0}.{1}.{4} IN ({5})
+                   AND {0}.{1}.{4} IN ({{}})
                   """.format(self.schema, table, where_col, where_val,
-                             where_col2,
-                             ', '.join(['%s'] * len(where_vals2)))
-        self.cursor.execute(command, where_vals2)
-        self.connection.commit()
+                             where_col2)
+        self.execute_batches(command, where_vals2, table, 'delete')
+
+    def get_read_cursor(self):
+        self.cursor_count += 1
+        cursor = self.connection.cursor(
+            name='steam_read_{}'.format(self.cursor_count))
+        cursor.itersize = self.fetch_size
+        return cursor
+
+    @staticmethod
+    def get_key_param(values):
+        return list(values)
+
+    def read_chunks(self, command, params=None, columns=None):
+        self.connect()
+        cursor = self.get_read_cursor()
+        cursor.execute(command, params)
+        chunks = []
+        while True:
+            data = cursor.fetchmany(self.fetch_size)
+            if not columns:
+                columns = [i[0] for i in cursor.description]
+            if not data:
+                break
+            chunks.append(pd.DataFrame(data=data, columns=columns))
+        cursor.close()
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True)
 
     def read_rds_two_where(self, table, select_col, where_col, where_val,
                            where_col2, where_val2):
-        self.connect()
         if select_col == where_col:
             command = """
                       SELECT {0}.{1}.{2}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
-                       AND {0}.{1}.{5} IN ({6})
+                       WHERE {0}.{1}.{3} {6}
+                       AND {0}.{1}.{4} IN ({5})
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)),
-                                 where_col2, where_val2)
+                                 where_col2, where_val2, self.key_filter)
+            columns = [select_col]
         else:
             command = """
                       SELECT {0}.{1}.{2}, {0}.{1}.{3}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
-                       AND {0}.{1}.{5} IN ({6})
+                       WHERE {0}.{1}.{3} {6}
+                       AND {0}.{1}.{4} IN ({5})
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)),
-                                 where_col2, where_val2)
-        self.cursor.execute(command, where_val)
-        data = self.cursor.fetchall()
-        if select_col == where_col:
-            data = pd.DataFrame(data=data, columns=[select_col])
-        else:
-            data = pd.DataFrame(data=data, columns=[select_col, where_col])
+                                 where_col2, where_val2, self.key_filter)
+            columns = [select_col, where_col]
+        data = self.read_chunks(command, (self.get_key_param(where_val),),
+                                columns)
         return data
 
     def read_rds(self, table, select_col, where_col, where_val):
-        self.connect()
         if select_col == where_col:
             command = """
                       SELECT {0}.{1}.{2}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
+                       WHERE {0}.{1}.{3} {4}
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)))
+                                 self.key_filter)
+            columns = [select_col]
         else:
             command = """
                       SELECT {0}.{1}.{2}, {0}.{1}.{3}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
+                       WHERE {0}.{1}.{3} {4}
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)))
-        self.cursor.execute(command, where_val)
-        data = self.cursor.fetchall()
-        if select_col == where_col:
-            data = pd.DataFrame(data=data, columns=[select_col])
-        else:
-            data = pd.DataFrame(data=data, columns=[select_col, where_col])
+                                 self.key_filter)
+            columns = [select_col, where_col]
+        data = self.read_chunks(command, (self.get_key_param(where_val),),
+                                columns)
         return data
 
-    def read_rds_table(self, table, where_col, where_val):
+    def get_revision(self):
         self.connect()
-        command = """
-                  SELECT *
-                   FROM {0}.{1}
-                   WHERE {0}.{1}.{2} IN ({3})
-                  """.format(self.schema, table, where_col,
-                             ', '.join(['%s'] * len(where_val)))
-        self.cursor.execute(command, where_val)
-        data = self.cursor.fetchall()
+        self.cursor.execute("SELECT to_regclass('alembic_version')")
+        if self.cursor.fetchone()[0] is None:
+            return None
+        self.cursor.execute('SELECT version_num FROM alembic_version')
+        revision = self.cursor.fetchone()
+        return revision[0] if revision else None
+
+    def load_metadata(self):
         self.connect()
+        revision = self.get_revision()
+        cache_key = (self.host, self.db, self.schema, revision)
+        if cache_key in metadata_cache:
+            self.metadata = metadata_cache[cache_key]
+            return None
+        logging.info('Loading table metadata for schema {} at revision '
+                     '{}'.format(self.schema, revision))
+        self.metadata = {}
+        for table, column, data_type in self.read_metadata():
+            if table not in self.metadata:
+                self.metadata[table] = []
+            self.metadata[table].append((column, data_type))
+        metadata_cache[cache_key] = self.metadata
+
+    def read_metadata(self):
         command = """
-                  SELECT *
+                  SELECT table_name, column_name, data_type
                   FROM information_schema.columns
-                  WHERE table_schema = '{0}'
-                  AND table_name = '{1}'
-                  """.format(self.schema, table)
-        self.cursor.execute(command)
-        columns = self.cursor.fetchall()
-        columns = [x[3] for x in columns]
-        data = pd.DataFrame(data=data, columns=columns)
+                  WHERE table_schema = %s
+                  ORDER BY table_name, ordinal_position
+                  """
+        self.cursor.execute(command, (self.schema,))
+        return self.cursor.fetchall()
+
+    def invalidate_metadata(self):
+        for key in [x for x in metadata_cache if x[:3] ==
+                    (self.host, self.db, self.schema)]:
+            metadata_cache.pop(key)
+        self.metadata = None
+
+    def get_table_columns(self, table):
+        if self.metadata is None:
+            self.load_metadata()
+        if table not in self.metadata:
+            self.invalidate_metadata()
+            self.load_metadata()
+        return [x[0] for x in self.metadata.get(table, [])]
+
+    def read_rds_table(self, table, where_col, where_val):
+        columns = self.get_table_columns(table)
+        if columns:
+            select_cols = ', '.join(columns)
+        else:
+            select_cols = '*'
+            columns = None
+        command = """
+                  SELECT {3}
+                   FROM {0}.{1}
+                   WHERE {0}.{1}.{2} {4}
+                  """.format(self.schema, table, where_col, select_cols,
+                             self.key_filter)
+        data = self.read_chunks(command, (self.get_key_param(where_val),),
+                                columns)
         return data
 
     def update_rows(self, table, set_cols, set_vals, where_col):
         logging.info('Updating {} row(s) from {}'.format(len(set_vals), table))
-        self.connect()
         command = """
                   UPDATE {0}.{1} AS t
                    SET {2}
-                   FROM (VALUES {3})
-                   AS c({4})
-                   WHERE c.{5} = t.{5}
+                   FROM (VALUES {{}})
+                   AS c({3})
+                   WHERE c.{4} = t.{4}
                   """.format(self.schema, table,
                              (', '.join(x + ' = c.' + x
                               for x in [where_col] + set_cols)),
-                             ', '.join(['%s'] * len(set_vals)),
                              ', '.join([where_col] + set_cols),
                              where_col)
-        self.cursor.execute(command, set_vals)
-        self.connection.commit()
+        self.execute_batches(command, set_vals, table, 'update')
 
     def update_rows_two_where(self, table, set_cols, set_vals, where_col,
                               where_col2, where_val2):
         logging.info('Updating {} row(s) from {}'.format(len(set_vals), table))
-        self.connect()
         command = """
                   UPDATE {0}.{1} AS t
                    SET {2}
-                   FROM (VALUES {3})
-                   AS c({4})
-                   WHERE c.{5} = t.{5}
-                   AND t.{6} = {7}
+                   FROM (VALUES {{}})
+                   AS c({3})
+                   WHERE c.{4} = t.{4}
+                   AND t.{5} = {6}
                   """.format(self.schema, table,
                              (', '.join(x + ' = c.' + x
                               for x in [where_col] + set_cols)),
-                             ', '.join(['%s'] * len(set_vals)),
                              ', '.join([where_col] + set_cols),
                              where_col, where_col2, where_val2)
-        self.cursor.execute(command, set_vals)
-        self.connection.commit()
+        self.execute_batches(command, set_vals, table, 'update')
 
     @staticmethod
     def read_file(filename):
@@ -411,6 +859,190 @@ class DB(object):
         return df
 
 
+class SQLiteDB(DB):
+    backend = 'sqlite'
+    key_filter = 'IN (SELECT value FROM json_each(?))'
+
+    def input_config(self, config):
+        logging.info('Loading DB config file: {}'.format(config))
+        self.configfile = os.path.join(config_path, config)
+        self.load_config()
+        self.conn_string = 'sqlite:///{}'.format(self.db)
+
+    def load_config(self):
+        try:
+            with open(self.configfile, 'r') as f:
+                self.config = json.load(f)
+        except IOError:
+            logging.error('{} not found.  Aborting.'.format(self.configfile))
+            sys.exit(0)
+        self.db = self.config['DATABASE']
+        self.host = 'localhost'
+        self.schema = 'main'
+        self.load_options()
+        self.parallel = False
+        self.config_list = [self.db]
+
+    @staticmethod
+    def register_adapters():
+        sqlite3.register_adapter(np.int64, int)
+        sqlite3.register_adapter(np.int32, int)
+        sqlite3.register_adapter(np.float64, float)
+        sqlite3.register_adapter(np.bool_, bool)
+        sqlite3.register_adapter(pd.Timestamp, lambda x: x.isoformat(' '))
+
+    def get_engine(self):
+        if self.engine is None:
+            self.register_adapters()
+            db_dir = os.path.dirname(self.db)
+            if db_dir:
+                utl.dir_check(db_dir)
+            self.engine = sqa.create_engine(
+                self.conn_string, connect_args={'check_same_thread': False})
+            if self.config.get('CREATE_TABLES', True):
+                mdl.Base.metadata.create_all(self.engine)
+        return self.engine
+
+    def get_read_cursor(self):
+        cursor = self.connection.cursor()
+        cursor.arraysize = self.fetch_size
+        return cursor
+
+    @staticmethod
+    def get_key_param(values):
+        return json.dumps(list(values), default=lambda x: x.item()
+                          if hasattr(x, 'item') else str(x))
+
+    def copy_from(self, table, df, columns):
+        logging.info('Writing {} row(s) to {}'.format(len(df), table))
+        command = """
+                  INSERT INTO {0}.{1} ({2})
+                   VALUES ({3})
+                  """.format(self.schema, table, ', '.join(columns),
+                             ', '.join(['?'] * len(columns)))
+        rows = df[list(columns)].itertuples(index=False, name=None)
+        self.execute_batches(command, rows, table, 'insert')
+
+    def upsert_from(self, table, df, where_col):
+        columns = list(df.columns)
+        set_cols = [x for x in columns if x != where_col]
+        logging.info('Upserting {} row(s) to {}'.format(len(df), table))
+        if set_cols:
+            conflict = """
+                       DO UPDATE
+                       SET {0}
+                       WHERE {1}
+                       """.format(', '.join(x + ' = excluded.' + x
+                                            for x in set_cols),
+                                  ' OR '.join('t.{0} IS NOT excluded.{0}'.
+                                              format(x) for x in set_cols))
+        else:
+            conflict = 'DO NOTHING'
+        command = """
+                  INSERT INTO {0}.{1} AS t ({2})
+                   VALUES ({3})
+                   ON CONFLICT ({4}) {5}
+                  """.format(self.schema, table, ', '.join(columns),
+                             ', '.join(['?'] * len(columns)), where_col,
+                             conflict)
+        rows = df.itertuples(index=False, name=None)
+        self.execute_batches(command, rows, table, 'upsert')
+
+    def execute_batches(self, command, rows, table, action):
+        self.connect()
+        for batch, batch_size in self.batcher.get_batches(rows):
+            start_time = time.time()
+            self.cursor.executemany(command, batch)
+            elapsed = time.time() - start_time
+            self.record_write(table, action, len(batch), batch_size, elapsed)
+            logging.debug('{} batch of {} row(s) ({:.1f} KiB) in {} took '
+                          '{:.2f}s'.format(action, len(batch),
+                                           batch_size / 1024.0, table,
+                                           elapsed))
+        self.commit()
+        return []
+
+    def insert_rds(self, table, columns, values, return_col):
+        rows = values
+        if not values or not isinstance(values[0], (list, tuple)):
+            rows = [tuple(values)]
+        command = """
+                  INSERT INTO {0}.{1} ({2})
+                   VALUES ({3})
+                   RETURNING {4}
+                  """.format(self.schema, table, ', '.join(columns),
+                             ', '.join(['?'] * len(columns)), return_col)
+        self.connect()
+        data = []
+        for row in rows:
+            self.cursor.execute(command, row)
+            data.extend(self.cursor.fetchall())
+        self.commit()
+        data = pd.DataFrame(data=data, columns=[return_col])
+        return data
+
+    def delete_rows(self, table, where_col, where_val,
+                    where_col2, where_vals2):
+        logging.info('Deleting {} row(s) from {}'.format(len(where_vals2),
+                                                         table))
+        command = """
+                  DELETE FROM {0}.{1}
+                   WHERE {2} IN ({3})
+                   AND {4} = ?
+                  """.format(self.schema, table, where_col, where_val,
+                             where_col2)
+        rows = [(x,) for x in where_vals2]
+        self.execute_batches(command, rows, table, 'delete')
+
+    def update_rows(self, table, set_cols, set_vals, where_col):
+        logging.info('Updating {} row(s) from {}'.format(len(set_vals), table))
+        command = """
+                  UPDATE {0}.{1}
+                   SET {2}
+                   WHERE {3} = ?
+                  """.format(self.schema, table,
+                             ', '.join(x + ' = ?' for x in set_cols),
+                             where_col)
+        rows = (tuple(x[1:]) + (x[0],) for x in set_vals)
+        self.execute_batches(command, rows, table, 'update')
+
+    def update_rows_two_where(self, table, set_cols, set_vals, where_col,
+                              where_col2, where_val2):
+        logging.info('Updating {} row(s) from {}'.format(len(set_vals), table))
+        command = """
+                  UPDATE {0}.{1}
+                   SET {2}
+                   WHERE {3} = ?
+                   AND {4} = {5}
+                  """.format(self.schema, table,
+                             ', '.join(x + ' = ?' for x in set_cols),
+                             where_col, where_col2, where_val2)
+        rows = (tuple(x[1:]) + (x[0],) for x in set_vals)
+        self.execute_batches(command, rows, table, 'update')
+
+    def get_revision(self):
+        self.connect()
+        self.cursor.execute("SELECT name FROM sqlite_master "
+                            "WHERE type = 'table' AND name = ?",
+                            ('alembic_version',))
+        if self.cursor.fetchone() is None:
+            return None
+        self.cursor.execute('SELECT version_num FROM alembic_version')
+        revision = self.cursor.fetchone()
+        return revision[0] if revision else None
+
+    def read_metadata(self):
+        self.cursor.execute("SELECT name FROM sqlite_master "
+                            "WHERE type = 'table' ORDER BY name")
+        metadata = []
+        for table in [x[0] for x in self.cursor.fetchall()]:
+            self.cursor.execute('PRAGMA {}.table_info("{}")'.format(
+                self.schema, table))
+            metadata.extend((table, x[1], x[2])
+                            for x in self.cursor.fetchall())
+        return metadata
+
+
 class DBSchema(object):
     def __init__(self, config_file):
         self.config_file = config_file
@@ -452,6 +1084,14 @@ class DBSchema(object):
         self.cols = self.config[exc.columns][table]
         self.fk = self.config[exc.fk][table]
 
+    def get_dependencies(self):
+        dependencies = {}
+        for table in self.table_list:
+            fk_tables = self.config[exc.fk][table].keys()
+            dependencies[table] = set(x for x in fk_tables
+                                      if x in self.table_list and x != table)
+        return dependencies
+
     def get_cols_for_export(self, table):
         self.set_table(table)
         fk_list = [self.fk[x][1] for x in self.fk]
@@ -461,11 +1101,15 @@ class DBSchema(object):
 
 
 class DFTranslation(object):
-    def __init__(self, config_file, data_file, db=None):
+    def __init__(self, config_file, data_file, db=None, chunksize=None,
+                 watermark=None):
         self.config_file = config_file
         self.full_config_file = os.path.join(config_path, self.config_file)
         self.data_file = data_file
         self.db = db
+        self.chunksize = chunksize
+        self.watermark = watermark
+        self.max_date = None
         self.translation = None
         self.db_columns = None
         self.df_columns = None
@@ -479,7 +1123,8 @@ class DFTranslation(object):
         self.int_columns = None
         self.real_columns = None
         self.load_translation(self.full_config_file)
-        self.load_df(self.data_file)
+        if self.data_file and not self.chunksize:
+            self.load_df(self.data_file)
 
     def load_translation(self, config_file):
         df = pd.read_csv(config_file)
@@ -500,20 +1145,112 @@ class DFTranslation(object):
         self.real_columns = [k for k, v in self.translation_type.items()
                              if v == 'REAL' or v == 'DECIMAL']
 
-    def load_df(self, datafile):
+    def get_read_types(self):
+        read_types = {}
+        for col in self.df_columns:
+            data_type = self.translation_type[self.translation[col]]
+            if data_type in ['TEXT', 'VARCHAR']:
+                read_types[col] = str
+            elif data_type in ['REAL', 'DECIMAL']:
+                read_types[col] = float
+            elif data_type in ['INT', 'INTEGER', 'BIGINT']:
+                read_types[col] = 'Int64'
+        return read_types
+
+    def get_date_columns(self):
+        return [x for x in self.df_columns
+                if self.translation[x] in self.date_columns]
+
+    @staticmethod
+    def get_encoding(datafile, block_size=1048576):
+        decoder = codecs.getincrementaldecoder('utf-8')()
         try:
-            self.df = pd.read_csv(datafile, encoding='utf-8')
+            with open(datafile, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
         except UnicodeDecodeError:
-            self.df = pd.read_csv(datafile, encoding='iso-8859-1')
+            return 'iso-8859-1'
+        return 'utf-8'
+
+    def set_file_columns(self, datafile, encoding='utf-8'):
+        if out.is_parquet_file(datafile):
+            out.check_pyarrow()
+            file_columns = out.pq.read_schema(datafile).names
+        else:
+            file_columns = pd.read_csv(datafile, nrows=0,
+                                       encoding=encoding).columns
         self.df_columns = [x for x in self.df_columns
-                           if x in list(self.df.columns)]
+                           if x in list(file_columns)]
+
+    def read_df(self, datafile, chunksize=None):
+        if out.is_parquet_file(datafile):
+            self.set_file_columns(datafile)
+            return self.read_parquet(datafile, chunksize)
+        encoding = 'utf-8'
+        if chunksize:
+            encoding = self.get_encoding(datafile)
+        self.set_file_columns(datafile, encoding)
+        kwargs = {'usecols': self.df_columns, 'dtype': self.get_read_types(),
+                  'parse_dates': self.get_date_columns(),
+                  'chunksize': chunksize}
+        try:
+            df = pd.read_csv(datafile, encoding=encoding, **kwargs)
+        except UnicodeDecodeError:
+            df = pd.read_csv(datafile, encoding='iso-8859-1', **kwargs)
+        return df
+
+    def read_parquet(self, datafile, chunksize=None):
+        if chunksize:
+            pf = out.pq.ParquetFile(datafile)
+            batches = pf.iter_batches(batch_size=chunksize,
+                                      columns=self.df_columns)
+            return (x.to_pandas(integer_object_nulls=True) for x in batches)
+        df = out.pq.read_table(datafile, columns=self.df_columns)
+        df = df.to_pandas(integer_object_nulls=True)
+        return df
+
+    def load_df(self, datafile):
+        with prf.phase('translate'):
+            self.df = self.read_df(datafile)
+            self.process_df()
+
+    def set_df(self, df):
+        with prf.phase('translate'):
+            self.df_columns = [x for x in self.translation
+                               if x in df.columns]
+            self.df = df
+            self.process_df()
+
+    def get_chunks(self):
+        for df in self.read_df(self.data_file, self.chunksize):
+            with prf.phase('translate'):
+                self.df = df
+                self.process_df()
+            yield self.df
+
+    def process_df(self):
         self.df = self.df[self.df_columns]
         self.df = self.df.rename(columns=self.translation)
         self.df = self.clean_types_for_upload(self.df)
+        self.filter_watermark()
         self.add_event_name()
         replace_dict = {'"': '', "\\\\": '/', '\r': '', '\n': '', '\t': ''}
         self.df.replace(replace_dict, regex=True, inplace=True)
 
+    def filter_watermark(self):
+        if exc.event_date not in self.df.columns:
+            return None
+        max_date = self.df[exc.event_date].max()
+        if not pd.isnull(max_date):
+            if self.max_date is None or max_date > self.max_date:
+                self.max_date = max_date
+        if self.watermark is not None:
+            total_rows = len(self.df)
+            self.df = self.df[self.df[exc.event_date] >= self.watermark]
+            logging.info('Kept {} of {} row(s) from {} on'.format(
+                len(self.df), total_rows, self.watermark))
+
     def add_event_name(self):
         for name in exc.event_dict:
             for idx, col in enumerate(exc.event_dict[name]):
@@ -560,7 +1297,7 @@ class DFTranslation(object):
             df[col] = df[col].replace(pd.NaT, None)
             df[col] = df[col].replace(pd.NaT, dt.datetime.today())
         if data_type in ['INT', 'INTEGER', 'BIGINT']:
-            df[col] = df[col].replace(np.nan, 0)
+            df[col] = df[col].fillna(0)
             df[col] = df[col].astype('int64')
         return df
 
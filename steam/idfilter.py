@@ -0,0 +1,222 @@
+import os
+import math
+import random
+import logging
+import threading
+import numpy as np
+import steam.utils as utl
+
+
+def splitmix64(values):
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = ((values ^ (values >> np.uint64(30))) *
+                  np.uint64(0xBF58476D1CE4E5B9))
+        values = ((values ^ (values >> np.uint64(27))) *
+                  np.uint64(0x94D049BB133111EB))
+    return values ^ (values >> np.uint64(31))
+
+
+def to_uint64(ids):
+    return np.asarray(ids, dtype=np.uint64).reshape(-1)
+
+
+class BloomFilter(object):
+    magic = 0x5354454D424C4F4D
+    header_size = 4
+    default_capacity = 2 * 10 ** 7
+    default_error_rate = 0.01
+
+    def __init__(self, file_name, capacity=None, error_rate=None):
+        self.file_name = file_name
+        self.capacity = capacity or self.default_capacity
+        self.error_rate = error_rate or self.default_error_rate
+        self.lock = threading.Lock()
+        self.data = None
+        self.bits = None
+        self.nbits = None
+        self.k = None
+        self.open()
+
+    def get_size(self):
+        nbits = -self.capacity * math.log(self.error_rate) / math.log(2) ** 2
+        nbits = int(math.ceil(nbits / 64.0)) * 64
+        k = max(int(round(float(nbits) / self.capacity * math.log(2))), 1)
+        return nbits, k
+
+    def open(self):
+        if os.path.isfile(self.file_name):
+            self.data = np.lib.format.open_memmap(self.file_name, mode='r+')
+            if self.data[0] != np.uint64(self.magic):
+                raise ValueError('{} is not a bloom filter.'.format(
+                    self.file_name))
+        else:
+            dir_name = os.path.dirname(self.file_name)
+            if dir_name:
+                utl.dir_check(dir_name)
+            nbits, k = self.get_size()
+            self.data = np.lib.format.open_memmap(
+                self.file_name, mode='w+', dtype=np.uint64,
+                shape=(self.header_size + nbits // 64,))
+            self.data[:self.header_size] = [self.magic, nbits, k, 0]
+        self.nbits = int(self.data[1])
+        self.k = int(self.data[2])
+        self.bits = self.data[self.header_size:]
+        logging.info('Loaded {} with {} ids in {:.1f} MB.'.format(
+            self.file_name, self.count, self.nbits / 8.0 / 1048576))
+
+    @property
+    def count(self):
+        return int(self.data[3])
+
+    def get_positions(self, ids):
+        h1 = splitmix64(to_uint64(ids))
+        h2 = splitmix64(h1) | np.uint64(1)
+        steps = np.arange(self.k, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            positions = h1[:, None] + steps[None, :] * h2[:, None]
+        return positions % np.uint64(self.nbits)
+
+    def contains(self, ids):
+        positions = self.get_positions(ids)
+        words = self.bits[(positions >> np.uint64(6)).astype(np.int64)]
+        masks = np.uint64(1) << (positions & np.uint64(63))
+        return ((words & masks) != 0).all(axis=1)
+
+    def __contains__(self, user_id):
+        return bool(self.contains([user_id])[0])
+
+    def add(self, ids):
+        ids = to_uint64(ids)
+        positions = self.get_positions(ids)
+        words = (positions >> np.uint64(6)).astype(np.int64)
+        masks = np.uint64(1) << (positions & np.uint64(63))
+        with self.lock:
+            new = ~self.contains(ids)
+            np.bitwise_or.at(self.bits, words.reshape(-1), masks.reshape(-1))
+            self.data[3] += np.uint64(new.sum())
+            if self.count > self.capacity:
+                logging.warning('{} holds {} ids, over its capacity of {}.  '
+                                'False positive rate is rising.'.format(
+                                    self.file_name, self.count,
+                                    self.capacity))
+
+    def flush(self):
+        self.data.flush()
+
+
+class HitStore(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.ids = np.array([], dtype=np.uint64)
+        self.pending = []
+        self.pending_set = set()
+        self.random = random.Random()
+        if os.path.isfile(self.file_name):
+            self.ids = np.load(self.file_name, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def __contains__(self, user_id):
+        idx = np.searchsorted(self.ids, np.uint64(user_id))
+        if idx < len(self.ids) and self.ids[idx] == np.uint64(user_id):
+            return True
+        return user_id in self.pending_set
+
+    def add(self, user_id):
+        with self.lock:
+            if user_id not in self.pending_set:
+                self.pending.append(user_id)
+                self.pending_set.add(user_id)
+
+    def get_random(self):
+        with self.lock:
+            total = len(self.ids) + len(self.pending)
+            if not total:
+                return None
+            idx = self.random.randrange(total)
+            if idx < len(self.ids):
+                return int(self.ids[idx])
+            return self.pending[idx - len(self.ids)]
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return None
+            ids = np.union1d(self.ids, to_uint64(self.pending))
+            dir_name = os.path.dirname(self.file_name)
+            if dir_name:
+                utl.dir_check(dir_name)
+            tmp_file = '{}.tmp'.format(self.file_name)
+            with open(tmp_file, 'wb') as f:
+                np.save(f, ids)
+            self.ids = None
+            os.replace(tmp_file, self.file_name)
+            self.ids = np.load(self.file_name, mmap_mode='r')
+            self.pending = []
+            self.pending_set = set()
+
+
+class IdFilter(object):
+    default_seen_file = os.path.join('data', 'seen_ids.npy')
+    default_hits_file = os.path.join('data', 'hit_ids.npy')
+    default_max_resample = 10
+
+    def __init__(self, seen_file=None, hits_file=None, capacity=None,
+                 error_rate=None, refresh_rate=0.0, max_resample=None):
+        self.seen = BloomFilter(seen_file or self.default_seen_file,
+                                capacity, error_rate)
+        self.hits = HitStore(hits_file or self.default_hits_file)
+        self.refresh_rate = refresh_rate or 0.0
+        self.max_resample = max_resample or self.default_max_resample
+        self.random = random.Random()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_ids = set()
+        self.skipped = 0
+
+    def get_refresh_id(self):
+        if (not self.refresh_rate or
+                self.random.random() >= self.refresh_rate):
+            return None
+        return self.hits.get_random()
+
+    def get_new_id(self, sample):
+        user_id, weight = sample()
+        skipped = 0
+        while self.is_seen(user_id) and skipped < self.max_resample:
+            skipped += 1
+            user_id, weight = sample()
+        if skipped:
+            with self.lock:
+                self.skipped += skipped
+        return user_id, weight, skipped
+
+    def is_seen(self, user_id):
+        return user_id in self.pending_ids or user_id in self.seen
+
+    def add(self, user_id, hit):
+        with self.lock:
+            self.pending.append((user_id, hit))
+            self.pending_ids.add(user_id)
+
+    def commit(self):
+        with self.lock:
+            if not self.pending:
+                return None
+            self.seen.add([x[0] for x in self.pending])
+            for user_id, hit in self.pending:
+                if hit and user_id not in self.hits:
+                    self.hits.add(user_id)
+            self.pending = []
+            self.pending_ids = set()
+
+    def flush(self):
+        self.commit()
+        self.seen.flush()
+        self.hits.flush()
+        logging.info('Seen ids: {}  Known hits: {}  Repeats skipped this '
+                     'run: {}'.format(self.seen.count, len(self.hits),
+                                      self.skipped))
@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+import pandas as pd
+import steam.utils as utl
+
+
+class CrawlJournal(object):
+    search = 'search'
+    current_players = 'current_players'
+    summaries = 'summaries'
+    app_details = 'app_details'
+    phase_list = [search, current_players, summaries, app_details]
+    default_flush_hits = 100
+
+    def __init__(self, journal_file, flush_hits=None):
+        self.journal_file = journal_file
+        self.flush_hits = flush_hits or self.default_flush_hits
+        self.header = {}
+        self.pending = []
+        self.pending_hits = 0
+        self.search_count = 0
+        self.number_hits = 0
+        self.buffer = utl.RecordBuffer()
+        self.phases = {}
+
+    def start(self, header):
+        logging.info('Starting crawl journal: {}'.format(self.journal_file))
+        dir_name = os.path.dirname(self.journal_file)
+        if dir_name:
+            utl.dir_check(dir_name)
+        self.header = header
+        with open(self.journal_file, 'w') as f:
+            f.write(json.dumps(dict(type='start', **header)) + '\n')
+
+    def load(self):
+        if not os.path.isfile(self.journal_file):
+            logging.warning('{} not found.'.format(self.journal_file))
+            return False
+        logging.info('Resuming crawl journal: {}'.format(self.journal_file))
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning('Skipping partial journal line.')
+                    continue
+                self.load_record(record)
+        logging.info('Journal loaded {} searches with {} hits and phases: '
+                     '{}'.format(self.search_count, self.number_hits,
+                                 list(self.phases.keys())))
+        return True
+
+    def load_record(self, record):
+        record_type = record.pop('type')
+        if record_type == 'start':
+            self.header = record
+        elif record_type == self.search:
+            self.search_count += 1
+            if record['games']:
+                self.number_hits += 1
+                self.buffer.extend(record['games'])
+        elif record_type == 'phase':
+            self.phases[record['phase']] = pd.DataFrame(record['rows'])
+
+    def add_search(self, user_id, games):
+        self.pending.append({'type': self.search, 'steam_id': user_id,
+                             'games': games})
+        self.search_count += 1
+        if games:
+            self.number_hits += 1
+            self.pending_hits += 1
+        if self.pending_hits >= self.flush_hits:
+            self.flush()
+            return True
+        return False
+
+    def add_phase(self, phase, df):
+        rows = []
+        if df is not None:
+            rows = json.loads(df.to_json(orient='records'))
+        self.pending.append({'type': 'phase', 'phase': phase, 'rows': rows})
+        self.phases[phase] = df
+        self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return None
+        with open(self.journal_file, 'a') as f:
+            for record in self.pending:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        logging.debug('Flushed {} journal records.'.format(len(self.pending)))
+        self.pending = []
+        self.pending_hits = 0
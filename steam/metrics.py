@@ -0,0 +1,163 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextlib
+import steam.utils as utl
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+duration_buckets = (0.1, 1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 14400.0,
+                    86400.0)
+
+
+class Histogram(object):
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def get_quantile(self, quantile):
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        total = 0
+        for idx, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                if idx < len(self.buckets):
+                    return min(self.buckets[idx], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min, 'max': self.max,
+                'p50': self.get_quantile(0.5), 'p90': self.get_quantile(0.9),
+                'p99': self.get_quantile(0.99)}
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.start_time = time.time()
+
+    @staticmethod
+    def get_key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, buckets=latency_buckets, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, buckets,
+                         **labels)
+
+    def get_counter(self, name, **labels):
+        return self.counters.get(self.get_key(name, labels), 0)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.start_time = time.time()
+
+    def to_dict(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, v.to_dict())
+                                for k, v in self.histograms.items())
+        return {'start_time': self.start_time,
+                'elapsed': time.time() - self.start_time,
+                'counters': [{'name': k[0], 'labels': dict(k[1]), 'value': v}
+                             for k, v in counters],
+                'histograms': [dict(name=k[0], labels=dict(k[1]), **v)
+                               for k, v in histograms]}
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        labels = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')) for k, v in labels]
+        return '{{{}}}'.format(','.join(labels))
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        names = set()
+        for (name, labels), value in counters:
+            if name not in names:
+                lines.append('# TYPE {} counter'.format(name))
+                names.add(name)
+            lines.append('{}{} {}'.format(name, self.format_labels(labels),
+                                          value))
+        for (name, labels), hist in histograms:
+            if name not in names:
+                lines.append('# TYPE {} histogram'.format(name))
+                names.add(name)
+            total = 0
+            for bucket, count in zip(hist.buckets + ('+Inf',), hist.counts):
+                total += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, self.format_labels(labels, [('le', bucket)]),
+                    total))
+            lines.append('{}_sum{} {}'.format(
+                name, self.format_labels(labels), hist.sum))
+            lines.append('{}_count{} {}'.format(
+                name, self.format_labels(labels), hist.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, file_name):
+        utl.write_config_file(file_name, self.to_dict())
+
+    def write_prometheus(self, file_name):
+        dir_name = os.path.dirname(file_name)
+        if dir_name:
+            utl.dir_check(dir_name)
+        tmp_file = '{}.tmp'.format(file_name)
+        with open(tmp_file, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_file, file_name)
+
+    def write(self, json_file, prometheus_file=None):
+        self.write_json(json_file)
+        logging.info('Wrote metrics summary to {}'.format(json_file))
+        if prometheus_file:
+            self.write_prometheus(prometheus_file)
+            logging.info('Wrote prometheus metrics to {}'.format(
+                prometheus_file))
+
+
+registry = Metrics()
@@ -8,7 +8,7 @@ Base = declarative_base()
 class Game(Base):
     __tablename__ = 'game'
     gameid = Column(Integer, primary_key=True)
-    appid = Column(BigInteger)
+    appid = Column(BigInteger, unique=True)
     gamename = Column(Text)
     gameevents = relationship('GameEvents', backref='game', lazy='dynamic')
     about_the_game = Column(Text)
@@ -47,7 +47,7 @@ class Game(Base):
 class GameEvents(Base):
     __tablename__ = 'gameevents'
     gameeventsid = Column(Integer, primary_key=True)
-    gameeventname = Column(Text)
+    gameeventname = Column(Text, unique=True)
     gameid = Column(Integer, ForeignKey('game.gameid'))
     gameeventdate = Column(DateTime)
     current_players = Column(Integer)
@@ -57,7 +57,7 @@ class GameEvents(Base):
 class User(Base):
     __tablename__ = 'user'
     userid = Column(Integer, primary_key=True)
-    steam_id = Column(BigInteger)
+    steam_id = Column(BigInteger, unique=True)
     communityvisibilitystate = Column(Integer)
     profilestate = Column(Integer)
     personaname = Column(Text)
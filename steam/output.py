@@ -0,0 +1,190 @@
+import os
+import shutil
+import logging
+import pandas as pd
+import steam.utils as utl
+import steam.expcolumns as exc
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+csv_format = 'csv'
+parquet_format = 'parquet'
+output_formats = [csv_format, parquet_format]
+arrow_types = {
+    'TEXT': 'string', 'VARCHAR': 'string', 'INT': 'int64',
+    'INTEGER': 'int64', 'BIGINT': 'int64', 'BIGSERIAL': 'int64',
+    'REAL': 'float64', 'DECIMAL': 'float64', 'DATE': 'date32',
+    'DATETIME': 'timestamp'}
+
+
+def link_file(file_name, link_name):
+    if os.path.lexists(link_name):
+        os.remove(link_name)
+    try:
+        os.link(file_name, link_name)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(file_name), link_name)
+        except OSError:
+            logging.warning('Could not link {} copying instead.'.format(
+                link_name))
+            shutil.copyfile(file_name, link_name)
+
+
+class CsvStreamWriter(object):
+    def __init__(self, file_name, link_name=None, columns=None):
+        self.file_name = file_name
+        self.link_name = link_name
+        self.tmp_file = '{}.part'.format(self.file_name)
+        self.columns = columns
+        self.file = None
+        self.rows = 0
+
+    def open(self):
+        dir_name = os.path.dirname(self.file_name)
+        if dir_name:
+            utl.dir_check(dir_name)
+        self.file = open(self.tmp_file, 'w', newline='', encoding='utf-8')
+
+    def write(self, df):
+        header = self.file is None
+        if header:
+            self.open()
+        if self.columns is None:
+            self.columns = list(df.columns)
+        df = df.reindex(columns=self.columns)
+        df.to_csv(self.file, header=header, index=False)
+        self.rows += len(df)
+
+    def finalize(self):
+        if self.file is None:
+            self.open()
+        self.file.close()
+        os.replace(self.tmp_file, self.file_name)
+        logging.info('Wrote {} rows to {}'.format(self.rows, self.file_name))
+        if self.link_name:
+            link_file(self.file_name, self.link_name)
+
+
+def check_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for the {} format.'.format(
+            parquet_format))
+
+
+def is_parquet_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(4) == b'PAR1'
+
+
+def load_translation_types(translation_file):
+    df = pd.read_csv(os.path.join(utl.config_path, translation_file))
+    return dict(zip(df[exc.translation_df], df[exc.translation_type]))
+
+
+def get_arrow_type(data_type):
+    arrow_type = arrow_types.get(str(data_type).upper(), 'string')
+    if arrow_type == 'timestamp':
+        return pa.timestamp('us')
+    return getattr(pa, arrow_type)()
+
+
+def infer_arrow_type(df, col):
+    if df is None or col not in df.columns:
+        return pa.string()
+    try:
+        arrow_type = pa.Schema.from_pandas(
+            df[[col]], preserve_index=False).field(col).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()
+    if (pa.types.is_null(arrow_type) or pa.types.is_nested(arrow_type) or
+            pa.types.is_large_string(arrow_type)):
+        return pa.string()
+    return arrow_type
+
+
+def get_arrow_schema(columns, df_types=None, df=None):
+    check_pyarrow()
+    if not df_types:
+        df_types = {}
+    fields = []
+    for col in columns:
+        if col in df_types:
+            fields.append((col, get_arrow_type(df_types[col])))
+        else:
+            fields.append((col, infer_arrow_type(df, col)))
+    return pa.schema(fields)
+
+
+def df_to_schema(df, schema):
+    df = df.reindex(columns=schema.names)
+    for field in schema:
+        col = field.name
+        if pa.types.is_string(field.type):
+            df[col] = df[col].where(df[col].isnull(), df[col].astype('U'))
+        elif pa.types.is_integer(field.type):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        elif pa.types.is_floating(field.type):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        elif pa.types.is_boolean(field.type):
+            df[col] = df[col].astype('boolean')
+        elif pa.types.is_date(field.type):
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+        elif pa.types.is_timestamp(field.type):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+class ParquetStreamWriter(object):
+    def __init__(self, file_name, link_name=None, columns=None,
+                 df_types=None):
+        check_pyarrow()
+        self.file_name = file_name
+        self.link_name = link_name
+        self.tmp_file = '{}.part'.format(self.file_name)
+        self.columns = columns
+        self.df_types = df_types
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def open(self, df=None):
+        dir_name = os.path.dirname(self.file_name)
+        if dir_name:
+            utl.dir_check(dir_name)
+        if self.columns is None:
+            self.columns = [] if df is None else list(df.columns)
+        self.schema = get_arrow_schema(self.columns, self.df_types, df)
+        self.writer = pq.ParquetWriter(self.tmp_file, self.schema,
+                                       compression='snappy')
+
+    def write(self, df):
+        if self.writer is None:
+            self.open(df)
+        table = df_to_schema(df, self.schema)
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def finalize(self):
+        if self.writer is None:
+            self.open()
+        self.writer.close()
+        os.replace(self.tmp_file, self.file_name)
+        logging.info('Wrote {} rows to {}'.format(self.rows, self.file_name))
+        if self.link_name:
+            link_file(self.file_name, self.link_name)
+
+
+def get_writer(output_format, file_name, link_name=None, columns=None,
+               translation_file=None):
+    if output_format == parquet_format:
+        df_types = None
+        if translation_file:
+            df_types = load_translation_types(translation_file)
+        return ParquetStreamWriter(file_name, link_name, columns, df_types)
+    return CsvStreamWriter(file_name, link_name, columns)
@@ -0,0 +1,140 @@
+import time
+import queue
+import logging
+import threading
+import steam.utils as utl
+import steam.profiler as prf
+
+
+class Stage(object):
+    default_maxsize = 10000
+    default_flush_interval = 300.0
+    done = None
+
+    def __init__(self, name, method, workers=1, batch_size=1, maxsize=None,
+                 flush_interval=None, metrics=None):
+        self.name = name
+        self.method = method
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval or self.default_flush_interval
+        self.metrics = metrics
+        self.queue = queue.Queue(maxsize or self.default_maxsize)
+        self.lock = threading.Lock()
+        self.buffer = utl.RecordBuffer()
+        self.threads = []
+        self.error = None
+        self.cancelled = False
+        self.items = 0
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(
+                target=self.run, name='{}_{}'.format(self.name, idx),
+                daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def run(self):
+        with prf.phase(self.name, self.metrics):
+            batch = []
+            batch_time = None
+            while True:
+                timeout = None
+                if batch:
+                    timeout = max(batch_time + self.flush_interval -
+                                  time.time(), 0)
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    batch = self.process(batch)
+                    continue
+                if item is self.done:
+                    self.process(batch)
+                    break
+                if not batch:
+                    batch_time = time.time()
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    batch = self.process(batch)
+
+    def process(self, batch):
+        if not batch or self.error is not None or self.cancelled:
+            return []
+        try:
+            records = self.method(batch)
+        except Exception as e:
+            logging.exception('Stage {} failed.'.format(self.name))
+            self.error = e
+            return []
+        with self.lock:
+            self.items += len(batch)
+            self.buffer.extend(records)
+        return []
+
+    def close(self, cancel=False):
+        self.cancelled = cancel
+        for _ in self.threads:
+            self.queue.put(self.done)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None and not cancel:
+            raise self.error
+        logging.info('Stage {} processed {} item(s) into {} record(s).'.format(
+            self.name, self.items, len(self.buffer)))
+
+    def to_df(self):
+        return self.buffer.to_df()
+
+
+class CrawlPipeline(object):
+    def __init__(self, user_stages=None, app_stages=None):
+        self.user_stages = user_stages or []
+        self.app_stages = app_stages or []
+        self.stages = self.user_stages + self.app_stages
+        self.steam_ids = set()
+        self.appids = set()
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def add_user(self, steam_id):
+        if steam_id in self.steam_ids:
+            return None
+        self.steam_ids.add(steam_id)
+        for stage in self.user_stages:
+            stage.put(steam_id)
+
+    def add_app(self, appid):
+        if appid in self.appids:
+            return None
+        self.appids.add(appid)
+        for stage in self.app_stages:
+            stage.put(appid)
+
+    def add_hit(self, steam_id, games):
+        self.add_user(steam_id)
+        for game in games:
+            self.add_app(game['appid'])
+
+    def add_df(self, df):
+        if df.empty:
+            return None
+        for steam_id in df['steam_id'].dropna().unique().tolist():
+            self.add_user(steam_id)
+        for appid in df['appid'].unique().tolist():
+            self.add_app(appid)
+
+    def close(self, cancel=False):
+        errors = []
+        for stage in self.stages:
+            try:
+                stage.close(cancel)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
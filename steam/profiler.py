@@ -0,0 +1,235 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+import collections
+import datetime as dt
+import steam.utils as utl
+import steam.metrics as mtr
+
+active = None
+
+
+class PhaseProfile(object):
+    def __init__(self, name, mode):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.profile = None
+        if mode == Profiler.cprofile:
+            self.profile = cProfile.Profile()
+        self.samples = collections.Counter()
+        self.threads = set()
+
+
+class Profiler(object):
+    cprofile = 'cprofile'
+    sample = 'sample'
+    modes = [cprofile, sample]
+    default_interval = 0.02
+    default_top = 25
+    max_depth = 64
+    idle_phase = 'idle'
+
+    def __init__(self, run_dir=None, mode=cprofile, interval=None, top=None):
+        if not run_dir:
+            run_dir = os.path.join('data', 'profiles',
+                                   dt.datetime.today().strftime(
+                                       '%Y%m%d_%H%M%S'))
+        self.run_dir = run_dir
+        self.mode = mode
+        self.interval = interval or self.default_interval
+        self.top = top or self.default_top
+        self.phases = collections.OrderedDict()
+        self.stack = []
+        self.thread_stacks = {}
+        self.thread_id = None
+        self.sampler = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    def start(self):
+        global active
+        utl.dir_check(self.run_dir)
+        self.thread_id = threading.get_ident()
+        self.start_time = time.perf_counter()
+        if self.mode == self.sample:
+            self.stop_event.clear()
+            self.sampler = threading.Thread(target=self.sample_loop,
+                                            name='steam_profiler',
+                                            daemon=True)
+            self.sampler.start()
+        active = self
+        logging.info('Profiling phases in {} mode to {}'.format(
+            self.mode, self.run_dir))
+
+    def stop(self):
+        global active
+        active = None
+        if self.sampler is not None:
+            self.stop_event.set()
+            self.sampler.join()
+            self.sampler = None
+        self.write()
+
+    def get_phase(self, name):
+        with self.lock:
+            if name not in self.phases:
+                self.phases[name] = PhaseProfile(name, self.mode)
+            return self.phases[name]
+
+    def get_stack(self, thread_id):
+        if thread_id == self.thread_id:
+            return self.stack
+        with self.lock:
+            return self.thread_stacks.setdefault(thread_id, [])
+
+    @contextlib.contextmanager
+    def thread_phase(self, name):
+        thread_id = threading.get_ident()
+        phase = self.get_phase(name)
+        stack = self.get_stack(thread_id)
+        stack.append(name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                phase.seconds += time.perf_counter() - start_time
+                phase.calls += 1
+                phase.threads.add(thread_id)
+            stack.pop()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if threading.get_ident() != self.thread_id:
+            with self.thread_phase(name):
+                yield
+            return
+        phase = self.get_phase(name)
+        parent = self.phases[self.stack[-1]] if self.stack else None
+        if phase.profile is not None:
+            if parent is not None:
+                parent.profile.disable()
+            phase.profile.enable()
+        self.stack.append(name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase.seconds += time.perf_counter() - start_time
+            phase.calls += 1
+            self.stack.pop()
+            if phase.profile is not None:
+                phase.profile.disable()
+                if parent is not None:
+                    parent.profile.enable()
+
+    def get_frames(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def sample_loop(self):
+        sampler_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = list(self.get_stack(thread_id))
+                phase = self.get_phase(stack[-1] if stack
+                                       else self.idle_phase)
+                phase.samples[self.get_frames(frame)] += 1
+
+    @staticmethod
+    def get_file_name(idx, phase):
+        return '{:02d}_{}'.format(idx, phase.replace(os.sep, '_'))
+
+    def write_cprofile(self, idx, phase, f):
+        if phase.threads and not phase.profile.getstats():
+            f.write('Wall time only: ran on {} worker thread(s).\n'.format(
+                len(phase.threads)))
+            return None
+        file_name = os.path.join(self.run_dir,
+                                 self.get_file_name(idx, phase.name))
+        phase.profile.dump_stats(file_name + '.prof')
+        stream = io.StringIO()
+        try:
+            stats = pstats.Stats(phase.profile, stream=stream)
+        except TypeError:
+            return None
+        stats.sort_stats('cumulative').print_stats(self.top)
+        f.write(stream.getvalue())
+
+    def write_samples(self, idx, phase, f):
+        file_name = os.path.join(self.run_dir,
+                                 self.get_file_name(idx, phase.name))
+        with open(file_name + '.folded', 'w') as folded:
+            for stack, count in phase.samples.most_common():
+                folded.write('{} {}\n'.format(';'.join(stack), count))
+        total = sum(phase.samples.values())
+        inclusive = collections.Counter()
+        exclusive = collections.Counter()
+        for stack, count in phase.samples.items():
+            for func in set(stack):
+                inclusive[func] += count
+            if stack:
+                exclusive[stack[-1]] += count
+        f.write('{} samples\n'.format(total))
+        for title, counter in [('inclusive', inclusive),
+                               ('self', exclusive)]:
+            f.write('\nTop functions by {} samples:\n'.format(title))
+            for func, count in counter.most_common(self.top):
+                f.write('{:>8} {:>6.1f}%  {}\n'.format(
+                    count, count * 100.0 / total if total else 0, func))
+
+    def write(self):
+        elapsed = time.perf_counter() - self.start_time
+        summary_file = os.path.join(self.run_dir, 'summary.txt')
+        phases = list(self.phases.values())
+        ranked = sorted(phases, key=lambda x: x.seconds,
+                        reverse=True)
+        with open(summary_file, 'w') as f:
+            f.write('Profile mode: {}  Total seconds: {:.2f}\n\n'.format(
+                self.mode, elapsed))
+            f.write('{:<20} {:>12} {:>8} {:>8} {:>8}\n'.format(
+                'phase', 'seconds', 'calls', 'threads', 'pct'))
+            for phase in ranked:
+                f.write('{:<20} {:>12.2f} {:>8} {:>8} {:>7.1f}%\n'.format(
+                    phase.name, phase.seconds, phase.calls,
+                    len(phase.threads) or 1,
+                    phase.seconds * 100.0 / elapsed if elapsed else 0))
+            if any(x.threads for x in phases):
+                f.write('\nWorker thread phases add up wall time across '
+                        'their threads.\n')
+            for idx, phase in enumerate(phases):
+                f.write('\n{}\nPhase {}\n{}\n'.format('=' * 79, phase.name,
+                                                     '=' * 79))
+                if phase.profile is not None:
+                    self.write_cprofile(idx, phase, f)
+                else:
+                    self.write_samples(idx, phase, f)
+        logging.info('Wrote profile summary to {}'.format(summary_file))
+
+
+@contextlib.contextmanager
+def phase(name, metrics=None):
+    metrics = metrics or mtr.registry
+    with metrics.timer('steam_phase_seconds', mtr.duration_buckets,
+                       phase=name):
+        if active is None:
+            yield
+        else:
+            with active.phase(name):
+                yield
@@ -0,0 +1,120 @@
+import bisect
+import random
+import logging
+import threading
+
+
+class StratifiedSampler(object):
+    default_strata = 64
+    default_explore = 0.2
+    default_update_interval = 100
+    weight_col = 'sample_weight'
+
+    def __init__(self, first_id, last_id, strata=None, explore=None,
+                 update_interval=None):
+        self.first_id = first_id
+        self.last_id = last_id
+        self.strata = max(int(strata or self.default_strata), 1)
+        self.explore = self.default_explore if explore is None else explore
+        self.update_interval = (update_interval or
+                                self.default_update_interval)
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.width = float(self.last_id - self.first_id + 1) / self.strata
+        self.requests = [0] * self.strata
+        self.hits = [0] * self.strata
+        self.pending = 0
+        self.probs = None
+        self.cum_probs = None
+        self.update_probs()
+
+    def get_stratum(self, user_id):
+        stratum = int((user_id - self.first_id) / self.width)
+        return min(max(stratum, 0), self.strata - 1)
+
+    def get_bounds(self, stratum):
+        low = self.first_id + int(stratum * self.width)
+        high = self.first_id + int((stratum + 1) * self.width) - 1
+        return low, min(high, self.last_id)
+
+    def get_hit_rates(self):
+        return [(h + 1.0) / (n + 2.0)
+                for h, n in zip(self.hits, self.requests)]
+
+    def update_probs(self):
+        rates = self.get_hit_rates()
+        total = sum(rates)
+        uniform = 1.0 / self.strata
+        probs = [(1 - self.explore) * x / total + self.explore * uniform
+                 for x in rates]
+        cum_probs = []
+        cum_prob = 0
+        for prob in probs:
+            cum_prob += prob
+            cum_probs.append(cum_prob)
+        self.probs = probs
+        self.cum_probs = cum_probs
+        self.pending = 0
+
+    def sample(self):
+        with self.lock:
+            value = self.random.random() * self.cum_probs[-1]
+            stratum = min(bisect.bisect_right(self.cum_probs, value),
+                          self.strata - 1)
+            weight = 1.0 / (self.strata * self.probs[stratum])
+            low, high = self.get_bounds(stratum)
+            user_id = self.random.randint(low, high)
+        return user_id, weight
+
+    def record(self, user_id, hit):
+        stratum = self.get_stratum(user_id)
+        with self.lock:
+            self.requests[stratum] += 1
+            self.hits[stratum] += int(bool(hit))
+            self.pending += 1
+            if self.pending >= self.update_interval:
+                self.update_probs()
+
+    def get_hit_rate_estimate(self):
+        rates = [float(h) / n for h, n in zip(self.hits, self.requests) if n]
+        if len(rates) < self.strata:
+            return None
+        return sum(rates) / self.strata
+
+    def to_dict(self):
+        with self.lock:
+            return {'first_id': self.first_id, 'last_id': self.last_id,
+                    'strata': self.strata, 'requests': list(self.requests),
+                    'hits': list(self.hits)}
+
+    def load(self, state):
+        if not state or not state.get('requests'):
+            return None
+        old_first = state['first_id']
+        old_width = (float(state['last_id'] - old_first + 1) /
+                     len(state['requests']))
+        with self.lock:
+            for idx, (n, h) in enumerate(zip(state['requests'],
+                                             state['hits'])):
+                mid = old_first + int((idx + 0.5) * old_width)
+                if self.first_id <= mid <= self.last_id:
+                    stratum = self.get_stratum(mid)
+                    self.requests[stratum] += n
+                    self.hits[stratum] += h
+            self.update_probs()
+        logging.info('Loaded hit rates for {} strata from {} prior '
+                     'requests.'.format(self.strata, sum(self.requests)))
+
+    def log_report(self):
+        estimate = self.get_hit_rate_estimate()
+        with self.lock:
+            requests = sum(self.requests)
+            hits = sum(self.hits)
+            best = max(range(self.strata), key=lambda x: self.probs[x])
+        sample_rate = float(hits) / requests if requests else 0
+        logging.info('Stratified sampling hit rate {:.2%} over {} requests.  '
+                     'Weighted population hit rate estimate: {}.  Largest '
+                     'allocation is stratum {} at {:.2%}.'.format(
+                         sample_rate, requests,
+                         '{:.2%}'.format(estimate) if estimate is not None
+                         else 'n/a', best, self.probs[best]))
@@ -1,18 +1,87 @@
 import os
+import sys
 import time
-import json
+import functools
 import random
 import logging
+import threading
 import requests
+import urllib.parse as urlparse
 import pandas as pd
 import datetime as dt
 import steam.utils as utl
+import steam.cache as cache
+import steam.journal as jrn
+import steam.sampler as smp
+import steam.idfilter as idf
+import steam.output as out
+import steam.metrics as mtr
+import steam.profiler as prf
+import steam.pipeline as ppl
+import email.utils as eut
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class RateLimiter(object):
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.time()
+
+    def wait(self):
+        if not self.rate:
+            return None
+        with self.lock:
+            now = time.time()
+            sleep_time = self.next_time - now
+            self.next_time = max(self.next_time, now) + (1.0 / self.rate)
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+
+class RetryPolicy(object):
+    def __init__(self, max_retries=5, backoff_base=2.0, backoff_max=300.0,
+                 jitter=0.5, retry_codes=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_codes = retry_codes
+
+    def get_backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        backoff = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return random.uniform(backoff * (1 - self.jitter), backoff)
+
+    @staticmethod
+    def get_retry_after(r):
+        retry_after = r.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            retry_date = eut.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        now = dt.datetime.now(retry_date.tzinfo)
+        return max((retry_date - now).total_seconds(), 0)
 
 
 class SteamApi(object):
     first_steam_id = 76561197960265729
     total_steam_users = (10 ** 9) * 4
     last_steam_id = first_steam_id + total_steam_users
+    max_account_id = 2 ** 32
+    default_state_file = os.path.join('data', 'state.json')
+    default_last_id_ttl = 24 * 7
+    default_app_cache_file = os.path.join('data', 'app_details.db')
+    default_journal_file = os.path.join('data', 'crawl_journal.jsonl')
+    default_write_chunk_size = 10000
+    handoff_file = 'steam_users.csv'
     default_search_num = 10 ** 5
     base_url = 'http://api.steampowered.com/'
     owned_games_url = base_url + 'IPlayerService/GetOwnedGames/v0001/'
@@ -20,197 +89,622 @@ class SteamApi(object):
     cur_players_url = base_url + 'ISteamUserStats/GetNumberOfCurrentPlayers/v1/'
     wishlist_url = base_url + 'wishlist/profiles/'
     player_sum_url = base_url + 'ISteamUser/GetPlayerSummaries/v2/'
-    app_det_url = 'http://store.steampowered.com/api/appdetails/'
+    store_url = 'http://store.steampowered.com/'
+    app_det_url = store_url + 'api/appdetails/'
+    url_attrs = ['owned_games_url', 'apps_url', 'cur_players_url',
+                 'wishlist_url', 'player_sum_url', 'app_det_url']
+    default_timeout = 30
+    timeouts = {owned_games_url: 10, cur_players_url: 10, player_sum_url: 20,
+                apps_url: 120, app_det_url: 30}
+    default_pool_size = 10
+    missing_user_codes = (400, 404)
+    default_stage_workers = 4
+    summaries_batch_size = 100
+    progress_interval = 1000
 
     def __init__(self, config_file=os.path.join('cfg', 'conf.json')):
         self.config_file = config_file
         self.config = utl.load_config_file(self.config_file)
         self.key = self.config['key']
+        self.rate_limiter = RateLimiter(self.config.get('rate_limit'))
+        self.retry_policy = RetryPolicy(**self.config.get('retry', {}))
+        self.session = None
+        self.pool_size = None
+        self.set_session(self.config.get('pool_size', self.default_pool_size))
+        self.state_file = self.config.get('state_file',
+                                          self.default_state_file)
+        self.last_id_ttl = self.config.get('last_steam_id_ttl',
+                                           self.default_last_id_ttl)
+        self.app_cache = cache.AppDetailsCache(
+            self.config.get('app_cache_file', self.default_app_cache_file),
+            self.config.get('app_details_ttl'))
+        self.journal = None
+        self.sampler = None
+        self.id_filter = None
+        self.pipeline = None
+        self.metrics = mtr.registry
+        self.endpoints = {}
+        if 'base_url' in self.config or 'store_url' in self.config:
+            self.set_base_urls(self.config.get('base_url', self.base_url),
+                               self.config.get('store_url', self.store_url))
+
+    def set_base_urls(self, base_url, store_url):
+        urls = {}
+        for attr in self.url_attrs:
+            url = getattr(SteamApi, attr)
+            new_url = url.replace(SteamApi.base_url, base_url).replace(
+                SteamApi.store_url, store_url)
+            setattr(self, attr, new_url)
+            urls[url] = new_url
+        self.base_url = base_url
+        self.store_url = store_url
+        self.timeouts = {urls[k]: v for k, v in SteamApi.timeouts.items()}
+
+    def set_session(self, pool_size):
+        logging.debug('Setting http session with pool size {}'.format(
+            pool_size))
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def set_last_steam_id(self):
-        self.total_steam_users = self.get_total_users()
-        self.last_steam_id = self.first_steam_id + self.total_steam_users
+        state = self.load_state()
+        last_id_age = time.time() - state.get('last_steam_id_time', 0)
+        if ('last_steam_id' in state and
+                last_id_age < self.last_id_ttl * 60 * 60):
+            logging.info('Using cached last steam id {} from {:.1f} hours '
+                         'ago.'.format(state['last_steam_id'],
+                                       last_id_age / (60 * 60)))
+            self.last_steam_id = state['last_steam_id']
+        else:
+            last_steam_id = self.get_last_steam_id()
+            if last_steam_id is not None:
+                self.last_steam_id = last_steam_id
+                state['last_steam_id'] = self.last_steam_id
+                state['last_steam_id_time'] = time.time()
+                self.write_state(state)
+            elif 'last_steam_id' in state:
+                logging.warning('Could not find the last steam id.  Using '
+                                'expired cached id {} from {:.1f} hours '
+                                'ago.'.format(state['last_steam_id'],
+                                              last_id_age / (60 * 60)))
+                self.last_steam_id = state['last_steam_id']
+            else:
+                logging.error('Could not find the last steam id.  '
+                              'Aborting.')
+                sys.exit(1)
+        self.total_steam_users = self.last_steam_id - self.first_steam_id
+
+    def load_state(self):
+        if not os.path.isfile(self.state_file):
+            return {}
+        return utl.load_config_file(self.state_file)
+
+    def write_state(self, state):
+        utl.write_config_file(self.state_file, state)
+
+    def get_sampler(self):
+        if (self.sampler is None or
+                self.sampler.first_id != self.first_steam_id or
+                self.sampler.last_id != self.last_steam_id):
+            self.sampler = smp.StratifiedSampler(
+                self.first_steam_id, self.last_steam_id,
+                self.config.get('strata'), self.config.get('strata_explore'))
+            self.sampler.load(self.load_state().get('strata'))
+        return self.sampler
+
+    def save_sampler(self):
+        self.sampler.log_report()
+        state = self.load_state()
+        state['strata'] = self.sampler.to_dict()
+        self.write_state(state)
+        if self.journal:
+            self.journal.flush()
+        if self.id_filter:
+            self.id_filter.flush()
 
-    def make_request(self, user_id, sleep_length=0, error=True):
-        url = '{}?key={}&steamid={}&format=json'.format(
-            self.owned_games_url, self.key, user_id)
-        r = self.raw_request(url, sleep_length, error)
+    def get_id_filter(self):
+        if self.id_filter is None and self.config.get('dedup_ids', True):
+            self.id_filter = idf.IdFilter(
+                self.config.get('seen_ids_file'),
+                self.config.get('hit_ids_file'),
+                self.config.get('seen_ids_capacity'),
+                self.config.get('seen_ids_error_rate'),
+                self.config.get('refresh_rate'))
+        return self.id_filter
+
+    def make_request(self, user_id, error=True, retry_policy=None,
+                     final_codes=()):
+        params = {'key': self.key, 'steamid': user_id, 'format': 'json'}
+        r = self.raw_request(self.owned_games_url, error, params,
+                             retry_policy, final_codes)
         return r
 
-    def raw_request(self, url, sleep_length=0, error=True, params=None):
-        if params:
-            try:
-                r = requests.get(url, params=params)
-            except requests.urllib3.exceptions.ProtocolError as e:
-                logging.warning('Error - retrying: {}'.format(e))
-                time.sleep(60)
-                r = self.raw_request(url, sleep_length, error, params)
-        else:
-            try:
-                r = requests.get(url)
-            except requests.urllib3.exceptions.ProtocolError as e:
-                logging.warning('Error - retrying: {}'.format(e))
-                time.sleep(60)
-                r = self.raw_request(url, sleep_length, error, params)
+    def get_endpoint(self, url):
+        if url not in self.endpoints:
+            parts = [x for x in urlparse.urlparse(url).path.split('/') if x]
+            parts = [x for x in parts
+                     if not (x[:1] == 'v' and x[1:].isdigit())]
+            self.endpoints[url] = parts[-1] if parts else url
+        return self.endpoints[url]
+
+    def timed_get(self, url, params, timeout, endpoint):
+        start_time = time.perf_counter()
         try:
-            r.json()
-            return r
-        except json.decoder.JSONDecodeError as e:
-            if error:
-                logging.warning('Response not json.  Error: {}\n {}'.format(
-                    e, r.text))
-            time.sleep(sleep_length)
-            return False
+            r = self.session.get(url, params=params, timeout=timeout)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout):
+            self.metrics.inc('steam_requests_total', endpoint=endpoint,
+                             status='error')
+            raise
+        finally:
+            self.metrics.observe('steam_request_seconds',
+                                 time.perf_counter() - start_time,
+                                 endpoint=endpoint)
+        self.metrics.inc('steam_requests_total', endpoint=endpoint,
+                         status=r.status_code)
+        self.metrics.inc('steam_response_bytes_total', len(r.content),
+                         endpoint=endpoint)
+        return r
 
-    @staticmethod
-    def get_numbers_from_list(number_list):
-        return sum([((10 ** y[0]) * y[1]) for y in number_list])
-
-    def get_total_users(self, last_number=12, number_list=None):
-        logging.info('Getting total users.')
-        if not number_list:
-            number_list = []
-        for exponent in range(last_number, 1, -1):
-            for multi in range(9, 1, -1):
-                user_id = (self.first_steam_id + ((10 ** exponent) * multi) +
-                           self.get_numbers_from_list(number_list))
-                if self.make_request(user_id, error=False):
-                    logging.info('10 to the power of {} times {} was a user. '
-                                 'Number list {}'.format(exponent, multi,
-                                                         number_list))
-                    number_list.append((exponent, multi))
-                    break
-        total_users = self.get_numbers_from_list(number_list)
-        return total_users
-
-    def user_search_loop(self, search_num=None):
+    def raw_request(self, url, error=True, params=None, retry_policy=None,
+                    final_codes=()):
+        if not retry_policy:
+            retry_policy = self.retry_policy
+        timeout = self.timeouts.get(url, self.default_timeout)
+        endpoint = self.get_endpoint(url)
+        for attempt in range(retry_policy.max_retries + 1):
+            retry_after = None
+            self.rate_limiter.wait()
+            try:
+                r = self.timed_get(url, params, timeout, endpoint)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                logging.debug('Request error: {}'.format(e))
+                r = None
+            if r is not None and r.status_code in retry_policy.retry_codes:
+                logging.debug('Status code {} from {}'.format(
+                    r.status_code, url))
+                retry_after = retry_policy.get_retry_after(r)
+            elif r is not None and r.status_code in final_codes:
+                return r
+            elif r is not None:
+                try:
+                    r.json()
+                    return r
+                except ValueError as e:
+                    self.metrics.inc('steam_invalid_responses_total',
+                                     endpoint=endpoint)
+                    logging.debug('Response not json.  Error: {}\n {}'.format(
+                        e, r.text))
+            if attempt < retry_policy.max_retries:
+                backoff = retry_policy.get_backoff(attempt, retry_after)
+                self.metrics.inc('steam_retries_total', endpoint=endpoint)
+                logging.debug('Retrying {} in {:.1f}s'.format(url, backoff))
+                time.sleep(backoff)
+        self.metrics.inc('steam_request_failures_total', endpoint=endpoint)
+        if error:
+            logging.warning('Request to {} failed after {} attempt(s).'.format(
+                url, retry_policy.max_retries + 1))
+        return False
+
+    def is_steam_user(self, user_id):
+        r = self.make_request(user_id, error=False,
+                              final_codes=self.missing_user_codes)
+        if r is False:
+            return None
+        return bool(r)
+
+    def get_last_steam_id(self):
+        logging.info('Getting last steam id.')
+        low = self.first_steam_id
+        high = self.first_steam_id + self.max_account_id
+        probes = 0
+        while high - low > 1:
+            mid = (low + high) // 2
+            probes += 1
+            is_user = self.is_steam_user(mid)
+            if is_user is None:
+                logging.warning('Probe of {} failed after retries.'.format(
+                    mid))
+                return None
+            if is_user:
+                low = mid
+            else:
+                high = mid
+        logging.info('Last steam id {} found with {} probes.'.format(
+            low, probes))
+        return low
+
+    def user_search_loop(self, search_num=None, workers=None, buffer=None,
+                         start=0, number_hits=0):
         if not search_num:
             search_num = self.default_search_num
-        number_hits = 0
-        df = pd.DataFrame()
-        for x in range(search_num):
-            logging.info('Search number {} of {} Hits: {}'
-                         .format(x, search_num, number_hits))
-            df, number_hits = self.get_random_user_df(df, number_hits)
-        return df
+        if not buffer:
+            buffer = utl.RecordBuffer()
+        self.get_sampler()
+        self.get_id_filter()
+        if workers and workers > 1:
+            self.user_search_loop_concurrent(
+                search_num, workers, buffer, start, number_hits)
+        else:
+            for x in range(start, search_num):
+                self.log_progress(x, search_num, number_hits)
+                number_hits = self.get_random_user_records(buffer,
+                                                           number_hits)
+        self.save_sampler()
+        return buffer.to_df()
+
+    def user_search_loop_concurrent(self, search_num, workers, buffer,
+                                    start=0, number_hits=0):
+        logging.info('Searching {} users with {} workers.'.format(
+            search_num, workers))
+        if workers > self.pool_size:
+            self.set_session(workers)
+        futures = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for x in range(start, search_num):
+                if len(futures) >= workers * 2:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    number_hits = self.get_records_from_futures(
+                        buffer, done, number_hits)
+                self.log_progress(x, search_num, number_hits)
+                futures.add(executor.submit(self.request_random_user))
+            done, futures = wait(futures)
+            number_hits = self.get_records_from_futures(
+                buffer, done, number_hits)
+        return number_hits
+
+    def log_progress(self, search_count, search_num, number_hits):
+        log = logging.debug
+        if not search_count % self.progress_interval:
+            log = logging.info
+        log('Search number {} of {} Hits: {}'.format(
+            search_count, search_num, number_hits))
+
+    def get_records_from_futures(self, buffer, futures, number_hits=0):
+        for future in futures:
+            r, user_id, weight = future.result()
+            number_hits = self.get_records_from_response(
+                buffer, r, user_id, number_hits, weight)
+        return number_hits
 
-    def get_random_user_df(self, df, number_hits=0):
-        r, user_id = self.request_random_user()
-        df, number_hits = self.get_df_from_response(df, r, user_id, number_hits)
-        return df, number_hits
+    def get_random_user_records(self, buffer, number_hits=0):
+        r, user_id, weight = self.request_random_user()
+        number_hits = self.get_records_from_response(
+            buffer, r, user_id, number_hits, weight)
+        return number_hits
+
+    def get_random_user_id(self):
+        sampler = self.get_sampler()
+        if not self.id_filter:
+            return sampler.sample()
+        user_id = self.id_filter.get_refresh_id()
+        if user_id is not None:
+            self.metrics.inc('steam_sampled_ids_total', source='refresh')
+            return user_id, None
+        user_id, weight, skipped = self.id_filter.get_new_id(sampler.sample)
+        self.metrics.inc('steam_sampled_ids_total', source='new')
+        self.metrics.inc('steam_repeat_ids_skipped_total', skipped)
+        return user_id, weight
 
     def request_random_user(self):
-        random_int = random.randint(self.first_steam_id, self.last_steam_id)
-        logging.info('Searching user {}'.format(random_int))
-        r = self.make_request(random_int, sleep_length=120)
-        return r, random_int
+        user_id, weight = self.get_random_user_id()
+        logging.debug('Searching user {}'.format(user_id))
+        r = self.make_request(user_id)
+        return r, user_id, weight
 
     def request_random_user_wishlist(self):
         random_int = random.randint(self.first_steam_id, self.last_steam_id)
-        logging.info('Searching user {}'.format(random_int))
+        logging.debug('Searching user {}'.format(random_int))
         wish_url = ('{}{}/wishlistdata/?p=0'.format(
             self.wishlist_url, random_int))
-        r = requests.get(wish_url)
+        r = self.session.get(wish_url, timeout=self.default_timeout)
         return r
 
     @staticmethod
-    def get_df_from_response(df, r, user_id, number_hits=0):
-        if r and ('response' in r.json() and r.json()['response'] and
-                  'games' in r.json()['response']):
+    def get_games_from_response(r, user_id, weight=None):
+        games = []
+        if r:
+            response = r.json().get('response')
+            if response and 'games' in response:
+                games = response['games']
+        for game in games:
+            game['steam_id'] = user_id
+            if weight is not None:
+                game[smp.StratifiedSampler.weight_col] = weight
+        return games
+
+    def get_records_from_response(self, buffer, r, user_id, number_hits=0,
+                                  weight=None):
+        games = self.get_games_from_response(r, user_id, weight)
+        if self.sampler and weight is not None:
+            self.sampler.record(user_id, games)
+        if self.id_filter:
+            self.id_filter.add(user_id, games)
+        if games:
             number_hits += 1
-            tdf = pd.DataFrame(r.json()['response']['games'])
-            tdf['steam_id'] = user_id
-            df = df.append(tdf, ignore_index=True)
-        return df, number_hits
+            buffer.extend(games)
+            self.metrics.inc('steam_records_parsed_total', len(games),
+                             phase=jrn.CrawlJournal.search)
+        self.metrics.inc('steam_searches_total',
+                         result='hit' if games else 'miss')
+        if self.journal and self.journal.add_search(user_id, games):
+            if self.id_filter:
+                self.id_filter.commit()
+        if games and self.pipeline:
+            self.pipeline.add_hit(user_id, games)
+        return number_hits
 
     def get_game_dict(self):
-        r = requests.get(self.apps_url)
+        r = self.raw_request(self.apps_url)
         game_dict = r.json()['applist']['apps']['app']
         game_dict = pd.DataFrame(game_dict)
         return game_dict
 
-    def get_data_write_df(self, search_num=None):
+    def run_app_list(self):
+        with prf.phase('app_list', self.metrics):
+            return self.get_game_dict()
+
+    def get_data_write_df(self, search_num=None, workers=None, refresh=False,
+                          resume=False, output_format=None):
         self.set_last_steam_id()
-        today_date = dt.datetime.today().date()
-        file_name = 'steam_users_{}.csv'.format(today_date.strftime('%Y%m%d'))
-        df = self.user_search_loop(search_num=search_num)
-        self.write_df(df, file_name)
+        self.journal = jrn.CrawlJournal(
+            self.config.get('journal_file', self.default_journal_file),
+            self.config.get('journal_flush_hits'))
+        if not (resume and self.journal.load()):
+            self.journal.start({
+                'date': dt.datetime.today().strftime('%Y%m%d'),
+                'search_num': search_num or self.default_search_num})
+        today_date = dt.datetime.strptime(self.journal.header['date'],
+                                          '%Y%m%d').date()
+        if not output_format:
+            output_format = self.config.get('output_format', out.csv_format)
+        file_name = 'steam_users_{}.{}'.format(
+            today_date.strftime('%Y%m%d'), output_format)
+        if self.config.get('pipeline', True):
+            results = self.run_pipeline(workers, refresh)
+        else:
+            results = self.run_phases(workers, refresh)
+        df, current_players, game_dict, player_stats, app_details = results
+        lookups = [game_dict, player_stats, app_details]
+        with prf.phase('write', self.metrics):
+            self.write_df(df, current_players, lookups, file_name,
+                          today_date, output_format)
+
+    def run_search(self, workers=None):
+        if jrn.CrawlJournal.search in self.journal.phases:
+            return self.journal.buffer.to_df()
+        with prf.phase(jrn.CrawlJournal.search, self.metrics):
+            df = self.user_search_loop(
+                search_num=self.journal.header['search_num'],
+                workers=workers, buffer=self.journal.buffer,
+                start=self.journal.search_count,
+                number_hits=self.journal.number_hits)
+        self.journal.add_phase(jrn.CrawlJournal.search, None)
+        return df
+
+    def run_phases(self, workers=None, refresh=False):
+        df = self.run_search(workers)
         app_list = df['appid'].unique().tolist()
-        current_players = self.get_current_players(app_list)
-        df = df.append(current_players, ignore_index=True, sort=True)
-        game_dict = self.get_game_dict()
-        df = df.merge(game_dict, on='appid', how='left')
+        current_players = self.run_phase(
+            jrn.CrawlJournal.current_players, self.get_current_players,
+            app_list)
+        game_dict = self.run_app_list()
         steam_ids = df[df['steam_id'].notnull()]['steam_id'].unique().tolist()
-        player_stats = self.get_player_stats(steam_ids)
-        df = df.merge(player_stats, on='steam_id', how='left')
-        app_details = self.get_app_details(app_list)
-        df = df.merge(app_details, on='appid', how='left')
-        df['gameeventdate'] = today_date
-        utl.dir_check('data')
-        self.write_df(df, file_name)
+        player_stats = self.run_phase(
+            jrn.CrawlJournal.summaries, self.get_player_stats, steam_ids)
+        app_details = self.run_phase(
+            jrn.CrawlJournal.app_details, self.get_app_details, app_list,
+            refresh)
+        return df, current_players, game_dict, player_stats, app_details
+
+    def get_stages(self, refresh=False):
+        stage_workers = self.config.get('stage_workers',
+                                        self.default_stage_workers)
+        queue_size = self.config.get('stage_queue_size')
+        flush_interval = self.config.get('stage_flush_interval')
+        stage_config = [
+            (jrn.CrawlJournal.summaries, self.request_player_stats,
+             self.summaries_batch_size, 1),
+            (jrn.CrawlJournal.current_players, self.request_current_players,
+             1, stage_workers),
+            (jrn.CrawlJournal.app_details, functools.partial(
+                self.request_app_details, refresh=refresh), 1, stage_workers)]
+        stages = {}
+        for phase, method, batch_size, stage_workers in stage_config:
+            if phase not in self.journal.phases:
+                stages[phase] = ppl.Stage(phase, method, stage_workers,
+                                          batch_size, queue_size,
+                                          flush_interval, self.metrics)
+        return stages
+
+    def run_pipeline(self, workers=None, refresh=False):
+        stages = self.get_stages(refresh)
+        pipeline = ppl.CrawlPipeline(
+            [stages[x] for x in [jrn.CrawlJournal.summaries] if x in stages],
+            [stages[x] for x in [jrn.CrawlJournal.current_players,
+                                 jrn.CrawlJournal.app_details]
+             if x in stages])
+        pool_size = (workers or 1) + sum(x.workers for x in stages.values())
+        if pool_size > self.pool_size:
+            self.set_session(pool_size + 1)
+        logging.info('Running search with stages: {}'.format(
+            list(stages.keys())))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            game_dict = executor.submit(self.run_app_list)
+            pipeline.start()
+            self.pipeline = pipeline
+            try:
+                pipeline.add_df(self.journal.buffer.to_df())
+                df = self.run_search(workers)
+            except BaseException:
+                pipeline.close(cancel=True)
+                raise
+            finally:
+                self.pipeline = None
+            pipeline.close()
+            game_dict = game_dict.result()
+        format_methods = {
+            jrn.CrawlJournal.current_players: self.format_current_players,
+            jrn.CrawlJournal.summaries: self.format_player_stats,
+            jrn.CrawlJournal.app_details: self.format_app_details}
+        results = {}
+        for phase, format_method in format_methods.items():
+            if phase not in stages:
+                logging.info('Using journaled results for {}'.format(phase))
+                results[phase] = self.journal.phases[phase]
+                continue
+            results[phase] = format_method(stages[phase].to_df())
+            self.metrics.inc('steam_records_parsed_total',
+                             len(results[phase]), phase=phase)
+            self.journal.add_phase(phase, results[phase])
+        if jrn.CrawlJournal.app_details in stages:
+            self.app_cache.commit()
+            self.app_cache.log_report()
+        return (df, results[jrn.CrawlJournal.current_players], game_dict,
+                results[jrn.CrawlJournal.summaries],
+                results[jrn.CrawlJournal.app_details])
+
+    def run_phase(self, phase, phase_method, *args):
+        if phase in self.journal.phases:
+            logging.info('Using journaled results for {}'.format(phase))
+            return self.journal.phases[phase]
+        with prf.phase(phase, self.metrics):
+            df = phase_method(*args)
+        self.metrics.inc('steam_records_parsed_total', len(df), phase=phase)
+        self.journal.add_phase(phase, df)
+        return df
 
     @staticmethod
-    def write_df(df, file_name):
-        logging.info('Writing df to csv: {}'.format(file_name))
-        df.to_csv(os.path.join('data', file_name), index=False)
-        df.to_csv('steam_users.csv', index=False)
-        logging.info('Finished writing df to csv')
+    def merge_lookups(df, game_dict, player_stats, app_details):
+        df = df.merge(game_dict, on='appid', how='left')
+        if 'steam_id' in df.columns:
+            df = df.merge(player_stats, on='steam_id', how='left')
+        df = df.merge(app_details, on='appid', how='left')
+        return df
 
-    def get_current_players(self, game_ids):
-        df = pd.DataFrame()
+    def write_df(self, df, current_players, lookups, file_name, event_date,
+                 output_format=out.csv_format):
+        logging.info('Writing df to {}: {}'.format(output_format, file_name))
+        columns = pd.concat([df.head(0), current_players.head(0)],
+                            ignore_index=True, sort=True)
+        columns = self.merge_lookups(columns, *lookups).columns
+        columns = list(columns) + ['gameeventdate']
+        writer = out.get_writer(
+            output_format, os.path.join('data', file_name),
+            self.handoff_file, columns,
+            self.config.get('translation_file'))
+        chunk_size = self.config.get('write_chunk_size',
+                                     self.default_write_chunk_size)
+        chunks = [df[x:x + chunk_size] for x in range(0, len(df), chunk_size)]
+        for chunk in chunks + [current_players]:
+            chunk = self.merge_lookups(chunk, *lookups)
+            chunk['gameeventdate'] = event_date
+            writer.write(chunk)
+        writer.finalize()
+        logging.info('Finished writing df to {}'.format(output_format))
+
+    def request_current_players(self, game_ids):
+        records = []
         for game_id in game_ids:
-            logging.info('Getting current_players for id: {}'.format(game_id))
-            r = self.raw_request(self.cur_players_url, sleep_length=60,
+            logging.debug('Getting current_players for id: {}'.format(game_id))
+            r = self.raw_request(self.cur_players_url,
                                  params={'appid': game_id})
             if r and 'player_count' in r.json()['response']:
-                tdf = pd.DataFrame([
+                records.append(
                     {'player_count': r.json()['response']['player_count'],
-                     'appid': game_id}])
-                df = df.append(tdf, ignore_index=True, sort=True)
+                     'appid': game_id})
             else:
                 logging.warning('Could not get player count for id: '
                                 '{} \n '.format(game_id))
-                if r is False:
-                    game_ids.append(game_id)
-                else:
+                if r:
                     logging.warning('Response: {}'.format(r.json()))
+        return records
+
+    @staticmethod
+    def format_current_players(df):
         df['appid'] = df['appid'].astype('int64')
         return df
 
-    def get_app_details(self, game_ids):
-        df = pd.DataFrame()
+    def get_current_players(self, game_ids):
+        buffer = utl.RecordBuffer()
+        buffer.extend(self.request_current_players(game_ids))
+        return self.format_current_players(buffer.to_df())
+
+    def request_app_details(self, game_ids, refresh=False):
+        records = []
+        if refresh:
+            cached = {}
+            self.app_cache.add_misses(game_ids)
+        else:
+            cached = self.app_cache.get_fresh(game_ids)
         for game_id in game_ids:
-            logging.info('Getting app details for id: {}'.format(game_id))
-            r = self.raw_request(self.app_det_url, sleep_length=60,
+            if int(game_id) in cached:
+                if cached[int(game_id)]:
+                    records.append(cached[int(game_id)])
+                continue
+            logging.debug('Getting app details for id: {}'.format(game_id))
+            r = self.raw_request(self.app_det_url,
                                  params={'appids': game_id})
             if r and r.json()[str(game_id)]['success']:
-                tdf = pd.DataFrame([r.json()[str(game_id)]['data']])
-                df = df.append(tdf, ignore_index=True, sort=True)
+                data = r.json()[str(game_id)]['data']
+                records.append(data)
+                self.app_cache.set(game_id, data)
             else:
                 logging.warning('Could not get details for id: '
                                 '{} \n '.format(game_id))
-                if r is False:
-                    game_ids.append(game_id)
-                else:
+                if r:
                     logging.warning('Response: {}'.format(r.json()))
+                    self.app_cache.set(game_id, None)
+        self.metrics.inc('steam_app_cache_total', len(cached), result='hit')
+        self.metrics.inc('steam_app_cache_total', len(game_ids) - len(cached),
+                         result='miss')
+        return records
+
+    @staticmethod
+    def format_app_details(df):
         df = df.rename(columns={'steam_appid': 'appid'})
         df = df.rename(columns={'name': 'app_detail_name'})
         df['appid'] = df['appid'].astype('int64')
         return df
 
-    def get_player_stats(self, steam_ids):
-        df = pd.DataFrame()
-        steam_ids = [steam_ids[x:x + 100]
-                     for x in range(0, len(steam_ids), 100)]
-        for steam_id in [x for x in steam_ids if x]:
-            logging.info('Getting player stats for id: {}'.format(steam_id))
-            r = self.raw_request(
-                self.player_sum_url, sleep_length=60, params={
-                    'key': self.key,
-                    'steamids': ','.join([str(int(x)) for x in steam_id])})
-            tdf = pd.DataFrame(r.json()['response']['players'])
-            df = df.append(tdf, ignore_index=True)
+    def get_app_details(self, game_ids, refresh=False):
+        buffer = utl.RecordBuffer()
+        buffer.extend(self.request_app_details(game_ids, refresh))
+        self.app_cache.commit()
+        self.app_cache.log_report()
+        return self.format_app_details(buffer.to_df())
+
+    def request_player_stats(self, steam_ids):
+        logging.debug('Getting player stats for id: {}'.format(steam_ids))
+        r = self.raw_request(
+            self.player_sum_url, params={
+                'key': self.key,
+                'steamids': ','.join([str(int(x)) for x in steam_ids])})
+        if r:
+            return r.json()['response']['players']
+        logging.warning('Could not get player stats for ids: '
+                        '{} \n '.format(steam_ids))
+        return []
+
+    @staticmethod
+    def format_player_stats(df):
         df = df.rename(columns={'steamid': 'steam_id'})
-        logging.info(df)
+        logging.debug(df)
         df['steam_id'] = df['steam_id'].astype('int64')
         return df
+
+    def get_player_stats(self, steam_ids):
+        buffer = utl.RecordBuffer()
+        size = self.summaries_batch_size
+        steam_ids = [steam_ids[x:x + size]
+                     for x in range(0, len(steam_ids), size)]
+        for steam_id in [x for x in steam_ids if x]:
+            buffer.extend(self.request_player_stats(steam_id))
+        return self.format_player_stats(buffer.to_df())
@@ -1,6 +1,8 @@
 import os
 import json
+import hashlib
 import logging
+import pandas as pd
 
 config_path = 'cfg'
 
@@ -17,3 +19,64 @@ def load_config_file(config_file):
         logging.warning('{} not found.'.format(config_file))
         config = {}
     return config
+
+
+def write_config_file(config_file, config):
+    dir_name = os.path.dirname(config_file)
+    if dir_name:
+        dir_check(dir_name)
+    tmp_file = '{}.tmp'.format(config_file)
+    with open(tmp_file, 'w') as f:
+        json.dump(config, f)
+    os.replace(tmp_file, config_file)
+
+
+def get_file_hash(file_name, block_size=1048576):
+    file_hash = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class RecordBuffer(object):
+    def __init__(self, chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.columns = {}
+        self.chunks = []
+        self.chunk_rows = 0
+        self.row_count = 0
+
+    def append(self, record):
+        for col, value in record.items():
+            if col not in self.columns:
+                self.columns[col] = [None] * self.chunk_rows
+            self.columns[col].append(value)
+        self.chunk_rows += 1
+        self.row_count += 1
+        for col in self.columns:
+            if len(self.columns[col]) < self.chunk_rows:
+                self.columns[col].append(None)
+        if self.chunk_rows >= self.chunk_size:
+            self.flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        if self.chunk_rows:
+            self.chunks.append(pd.DataFrame(self.columns))
+        self.columns = {}
+        self.chunk_rows = 0
+
+    def to_df(self):
+        self.flush()
+        if not self.chunks:
+            return pd.DataFrame()
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        return pd.concat(self.chunks, ignore_index=True, sort=True)
+
+    def __len__(self):
+        return self.row_count